@@ -4,9 +4,49 @@ from .syst_model import SystModel
 from astropy import constants as ac
 from astropy import units as au
 import datetime
+import multiprocessing as mp
 import numpy as np
 from matplotlib import pyplot as plt
 
+prefix = "Cookbook:"
+
+# Models fitted by the worker processes, inherited when they are forked (lmfit
+# composite models cannot be pickled)
+_fit_mods_l = []
+
+def _fit_mod_proc(args):
+    """ @brief Fit a model in a worker process.
+    @param args Index of the model and maximum number of function evaluation
+    @return Fitted parameters and statistics of the fit
+    """
+
+    i, maxfev = args
+    mod = _fit_mods_l[i]
+    mod._fit(fit_kws={'max_nfev': maxfev})
+    return mod._pars, mod._chi2r, mod._aic, mod._bic, mod._nfev
+
+# Base spectrum, templates and random seed of the completeness estimate,
+# inherited by the worker processes when they are forked
+_compl_d = {}
+
+def _compl_proc(args):
+    """ @brief Run a chunk of realizations of the completeness estimate.
+    @param args Index of the cell and range of realizations
+    @return Detections and redshifts of the simulated systems
+    """
+
+    icell, r_start, r_end = args
+    d = _compl_d
+    ret = []
+    for r in range(r_start, r_end):
+        # Each realization has its own random stream, independent of the
+        # process where it is run
+        rng = np.random.default_rng(np.random.SeedSequence(
+            d['seed'], spawn_key=(icell, r)))
+        ret.append(d['cb']._compl_real(d['spec'], *d['cells'][icell],
+                                       d['z_arr'], d['dz'], rng))
+    return ret
+
 class Cookbook(object):
     """ Class for cookbook.
 
@@ -28,11 +68,11 @@ class Cookbook(object):
 
     def _adapt_z(self, series, z_start, z_end):
         spec = self.sess.spec
-        z_min = np.max([(np.min(spec.x.to(au.nm))/xem_d[t]).value-1.0 \
-                        for t in series_d[series]])
+        x = spec.x.to_value(au.nm)
+        xem = atom_t['xem'][series_i_d[series]]
+        z_min = np.max(np.min(x)/xem)-1.0
         z_start = max(z_min, z_start)
-        z_max = np.min([(np.max(spec.x.to(au.nm))/xem_d[t]).value-1.0 \
-                        for t in series_d[series]])
+        z_max = np.min(np.max(x)/xem)-1.0
         z_end = min(z_max, z_end)
         return z_start, z_end
 
@@ -46,8 +86,9 @@ class Cookbook(object):
         # If the simulated system is falls by more than a HWHM over a masked
         # line, it is discarded
         ymin = np.min(ym)
-        sort = np.argsort(spec.x.to(au.nm))
-        ys = np.interp(spec.x.to(au.nm)[sort], xm, ym)
+        x = spec.x.to_value(au.nm)
+        sort = np.argsort(x)
+        ys = np.interp(x[sort], xm, ym)
         ysel = np.where(ys < 0.5*(ymin+1))
         #print(0.5*(ymin+1), np.sum(spec._t['lines_mask'][ysel]))
         if np.sum(spec._t['lines_mask'][ysel]) == 0:
@@ -65,6 +106,120 @@ class Cookbook(object):
             return 1
 
 
+    def _compl_real(self, spec_s, zs, ze, xm, ym, ym_0, ym_1, ym_2, xm_e,
+                    ym_e, z_arr, dz, rng):
+        """ @brief Simulate a system at a random redshift and test its
+        detection.
+
+        The spectrum is never copied: the simulated system is applied to the
+        window where it falls and where the template is tested, and the test
+        is run on this window only.
+        @param spec_s Sorted and normalized spectrum, with the line mask
+        @param zs Start redshift
+        @param ze End redshift
+        @param xm Wavelengths of the template (rest frame)
+        @param ym Template
+        @param ym_0 Template with no absorption
+        @param ym_1 Template with the first line only
+        @param ym_2 Template with the second line only
+        @param xm_e Wavelengths of the simulated system (rest frame)
+        @param ym_e Simulated system
+        @param z_arr Redshifts where the template is tested
+        @param dz Redshift tolerance for detection
+        @param rng Random generator
+        @return Detection and redshift of the simulated system
+        """
+
+        xs, ys, dys, mask = spec_s
+        z_rand = rng.random()*(ze-zs)+zs
+        z_round = round(z_rand, 4)
+        z_sel = z_arr[np.where(np.logical_and(z_arr > z_round-1.5*dz,
+                                              z_arr < z_round+1.5*dz))]
+        xe = xm_e*(1+z_rand)
+        xmin = np.min(np.append(xm[0]*(1+z_sel), xe[0]))
+        xmax = np.max(np.append(xm[-1]*(1+z_sel), xe[-1]))
+        w = slice(max(np.searchsorted(xs, xmin, 'right')-1, 0),
+                  min(np.searchsorted(xs, xmax)+1, len(xs)))
+        ys_w, dys_w = self._apply_doubl_win(xs[w], ys[w], dys[w], mask[w], xe,
+                                            ym_e)
+        for z in z_sel:
+            cond, _, _ = self._test_doubl(xm*(1+z), ym, ym_0, ym_1, ym_2,
+                                          spec_s=(xs[w], ys_w, dys_w))
+            if cond and np.abs(z-z_rand) < dz:
+                return True, z_rand
+        return False, z_rand
+
+    def _apply_doubl_win(self, xs, ys, dys, mask, xm, ym):
+        """ @brief Apply a simulated system to a window of the sorted
+        spectrum, without modifying the spectrum.
+        @param xs Wavelengths of the window (in nm)
+        @param ys Normalized flux of the window
+        @param dys Normalized error of the window
+        @param mask Line mask of the window
+        @param xm Wavelengths of the simulated system
+        @param ym Simulated system
+        @return Flux and error of the window with the simulated system
+        """
+
+        # If the simulated system is falls by more than a HWHM over a masked
+        # line, it is discarded
+        ymin = np.min(ym)
+        yi = np.interp(xs, xm, ym)
+        if np.sum(mask[yi < 0.5*(ymin+1)]) == 0:
+            return yi*ys, np.sqrt(yi)*dys
+        else:
+            return ys, dys
+
+    def _compl_run(self, spec, cells, n, z_arr, dz, seed=0, col='y',
+                   n_proc=1):
+        """ @brief Run the realizations of the completeness estimate, using a
+        pool of processes.
+        @param spec Base spectrum
+        @param cells Redshift ranges and templates of the cells
+        @param n Number of realizations per cell
+        @param z_arr Redshifts where the template is tested
+        @param dz Redshift tolerance for detection
+        @param seed Random seed
+        @param col Column where to test the models
+        @param n_proc Number of processes (0 to use all the cores)
+        @return Detections and redshifts of the simulated systems, per cell
+        """
+
+        if n_proc < 1:
+            n_proc = mp.cpu_count()
+        if 'fork' not in mp.get_all_start_methods():
+            n_proc = 1
+        chunk = min(n, max(1, len(cells)*n//(4*n_proc)))
+        tasks = [(i, r, min(r+chunk, n)) for i in range(len(cells))
+                 for r in range(0, n, chunk)]
+
+        # The spectrum is sorted and normalized once, and shared by all the
+        # realizations
+        sort = np.argsort(spec.x.to_value(au.nm))
+        spec_s = self._sort_spec(col)+(np.array(spec._t['lines_mask'])[sort],)
+        _compl_d.update({'cb': self, 'spec': spec_s, 'cells': cells,
+                         'z_arr': z_arr, 'dz': dz, 'seed': seed})
+        res = [[] for c in cells]
+        done = 0
+        pool = None
+        try:
+            if n_proc < 2:
+                res_iter = map(_compl_proc, tasks)
+            else:
+                pool = mp.get_context('fork').Pool(n_proc)
+                res_iter = pool.imap(_compl_proc, tasks)
+            for (icell, _, _), r in zip(tasks, res_iter):
+                res[icell] += r
+                done += len(r)
+                print(prefix, "I'm estimating completeness (%i/%i "
+                      "realizations)..." % (done, len(cells)*n), end='\r')
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            _compl_d.clear()
+        return res
+
     def _create_doubl(self, series='CIV', z_mean=2.0, logN=14, b=10,
                       resol=70000):
 
@@ -92,6 +247,39 @@ class Cookbook(object):
         systs._update(mod, mod_t=False)
         #print(systs._t)
 
+    def _fit_mods(self, mods, maxfev=None, n_proc=1):
+        """ @brief Fit a list of independent models, using a pool of
+        processes.
+        @param mods Models
+        @param maxfev Maximum number of function evaluation
+        @param n_proc Number of processes (0 to use all the cores)
+        """
+
+        systs = self.sess.systs
+        if n_proc < 1:
+            n_proc = mp.cpu_count()
+        n_proc = min(n_proc, len(mods))
+        if n_proc < 2 or 'fork' not in mp.get_all_start_methods():
+            for m in mods:
+                self._fit_mod(m, maxfev)
+            return
+
+        # Only the indices of the models are sent to the workers, and only the
+        # fitted parameters are sent back
+        _fit_mods_l[:] = mods
+        args = [(i, maxfev) for i in range(len(mods))]
+        try:
+            with mp.get_context('fork').Pool(n_proc) as pool:
+                res = pool.map(_fit_mod_proc, args,
+                               chunksize=max(1, len(args)//(4*n_proc)))
+        finally:
+            _fit_mods_l[:] = []
+
+        # Results are merged in the original order, as in the serial fit
+        for m, r in zip(mods, res):
+            m._pars, m._chi2r, m._aic, m._bic, m._nfev = r
+            systs._update(m, mod_t=False)
+
 
     def _fit_syst(self, series='CIV', z=2.0, logN=13.0, b=10.0, resol=70000.0,
                   maxfev=100):
@@ -151,7 +339,7 @@ class Cookbook(object):
         mod = SystModel(spec, systs, z0=z)
         mod._new_voigt(series, z, logN, b, resol)
 
-        systs._xs = np.array(spec._safe(spec.x).to(au.nm))
+        systs._xs = spec._safe(spec.x).to_value(au.nm)
         y = spec._t[col]
         dy = spec._t['dy']
         eval = mod.eval(x=systs._xs, params=mod._pars)
@@ -168,11 +356,75 @@ class Cookbook(object):
             return 1
 
 
-    def _test_doubl(self, xm, ym, ym_0, ym_1, ym_2, col='y'):
+    def _scan_doubl(self, xs, ys, dys, xm, ym, ym_0, ym_1, ym_2, z_range,
+                    mem=2**24):
+        """ @brief Test a doublet template at all redshifts of a grid, as in
+        _test_doubl.
+        @param xs Wavelengths of the spectrum (sorted, in nm)
+        @param ys Normalized flux of the spectrum
+        @param dys Normalized error of the spectrum
+        @param xm Wavelengths of the template (rest frame)
+        @param ym Template
+        @param ym_0 Template with no absorption
+        @param ym_1 Template with the first line only
+        @param ym_2 Template with the second line only
+        @param z_range Redshifts
+        @param mem Memory budget for the temporary arrays (bytes)
+        @return Conditions, chi2 with the template and without absorption
+        """
+
+        # Redshifts are scanned in chunks, so that the arrays of interpolated
+        # points (about five of them alive at a time) fit the budget
+        n = max(1, mem//(5*len(xm)*np.dtype(float).itemsize))
+        cond = np.empty(len(z_range), dtype=bool)
+        chi2 = np.empty(len(z_range))
+        chi2_0 = np.empty(len(z_range))
+        for s in range(0, len(z_range), n):
+            xz = np.outer(1+z_range[s:s+n], xm)
+            ysz = np.interp(xz, xs, ys)
+            dysz = np.interp(xz, xs, dys)
+            chi2[s:s+n] = np.sum(((ysz-ym)/dysz)**2, axis=1)
+            chi2_0[s:s+n] = np.sum(((ysz-ym_0)/dysz)**2, axis=1)
+            chi2_1 = np.sum(((ysz-ym_1)/dysz)**2, axis=1)
+            chi2_2 = np.sum(((ysz-ym_2)/dysz)**2, axis=1)
+            fact = 0.7
+            cond[s:s+n] = chi2[s:s+n] < fact*np.minimum(
+                np.minimum(chi2_0[s:s+n]-3, chi2_1), chi2_2)
+        return cond, chi2, chi2_0
+
+    def _sort_spec(self, col='y', swap=False):
+        """ @brief Sort and normalize the spectrum, to test templates.
+        @param col Column with the flux
+        @param swap Swap the wavelengths, to monitor correctness
+        @return Sorted wavelengths (in nm), normalized flux and error
+        """
+
         spec = self.sess.spec
-        sort = np.argsort(spec.x.to(au.nm))
-        ys = np.interp(xm, spec.x.to(au.nm)[sort], (spec._t[col]/spec._t['cont'])[sort])
-        dys = np.interp(xm, spec.x.to(au.nm)[sort], (spec.dy/spec._t['cont'])[sort])
+        x = spec.x.to_value(au.nm)
+        if swap:
+            x = x[::-1]
+        sort = np.argsort(x)
+        ys = np.array(spec._t[col]/spec._t['cont'])
+        dys = np.array(spec.dy/spec._t['cont'])
+        return x[sort], ys[sort], dys[sort]
+
+    def _test_doubl(self, xm, ym, ym_0, ym_1, ym_2, col='y', spec_s=None):
+        """ @brief Test a doublet template at a given position.
+        @param xm Wavelengths of the template
+        @param ym Template
+        @param ym_0 Template with no absorption
+        @param ym_1 Template with the first line only
+        @param ym_2 Template with the second line only
+        @param col Column where to test the template
+        @param spec_s Sorted and normalized spectrum (or window of it), as
+        returned by _sort_spec; if None, it is computed from the spectrum
+        @return Condition, chi2 with the template and without absorption
+        """
+
+        if spec_s is None:
+            spec_s = self._sort_spec(col)
+        ys = np.interp(xm, spec_s[0], spec_s[1])
+        dys = np.interp(xm, spec_s[0], spec_s[2])
         chi2 = np.sum(((ys-ym)/dys)**2)
         chi2r = chi2/(len(ys)-3)
         chi2_0 = np.sum(((ys-ym_0)/dys)**2)
@@ -191,7 +443,7 @@ class Cookbook(object):
         spec = self.sess.spec
         systs = self.sess.systs
 
-        systs._xs = np.array(spec._safe(spec.x).to(au.nm))
+        systs._xs = spec._safe(spec.x).to_value(au.nm)
         s = spec._where_safe
 
         y = spec.y
@@ -204,8 +456,7 @@ class Cookbook(object):
         model = spec._t['model']
         deabs = spec._t['deabs']
 
-        model[s] = cont[s]
-        for i, r in enumerate(systs._mods_t):
-            mod = r['mod']
-            model[s] = mod.eval(x=systs._xs, params=mod._pars) * model[s]
+        # The transmission of the models is updated incrementally, only where
+        # they changed
+        model[s] = systs._transmission() * cont[s]
         deabs[s] = cont[s] + y[s] - model[s]
@@ -2,6 +2,7 @@ from .spectrum import Spectrum
 from .line_list import LineList
 from .syst_list import SystList
 from astropy import units as au
+import bisect
 import numpy as np
 
 prefix = "Format:"
@@ -9,8 +10,70 @@ prefix = "Format:"
 class Format(object):
     """ Class for file formats. """
 
-    def __init__(self):
-        pass
+    def __init__(self, copy=True, xmin=None, xmax=None):
+        """ @brief Constructor for the file formats.
+        @param copy Copy the data of the files into the structures. If False,
+        the columns read straight from the files are not copied (e.g. when the
+        files are memory-mapped)
+        @param xmin Minimum wavelength of the spectra to read (nm)
+        @param xmax Maximum wavelength of the spectra to read (nm)
+        """
+
+        self._copy = copy
+        self._xmin = xmin
+        self._xmax = xmax
+
+    def _rows(self, x, xunit, log=False):
+        """ @brief Rows of a spectrum within the wavelength window, found with
+        a binary search on sorted wavelengths (so that only a few rows are
+        read). Two more rows are included on each side, to compute xmin and
+        xmax from the adjacent rows; spectra must be then cut exactly to the
+        window (see Session.open).
+        @param x Wavelengths (or their log10, if log is True)
+        @param xunit Unit of the wavelengths
+        @param log Whether x is the log10 of the wavelengths
+        @return Slice of the rows
+        """
+
+        n = len(x)
+        lim = []
+        for w, side, default in [(self._xmin, bisect.bisect_left, 0),
+                                 (self._xmax, bisect.bisect_right, n)]:
+            if w is None:
+                lim.append(default)
+            else:
+                w = (w*au.nm).to_value(xunit)
+                lim.append(side(x, np.log10(w) if log else w))
+        return slice(max(lim[0]-2, 0), min(lim[1]+2, n))
+
+    def _pixels(self, crval1, cdelt1, naxis1, n):
+        """ @brief Pixels of a spectrum with a log-linear wavelength grid
+        within the wavelength window, found from the grid (so that only these
+        pixels are read). As in _rows, two more pixels are included on each
+        side.
+        @param crval1 log10 of the first wavelength (Angstrom)
+        @param cdelt1 Step of the grid
+        @param naxis1 Number of pixels in the header
+        @param n Number of pixels in the data
+        @return Slice of the pixels and their wavelengths (Angstrom)
+        """
+
+        if self._xmin is None and self._xmax is None:
+            x = 10**np.arange(crval1, crval1+naxis1*cdelt1, cdelt1)[:n]
+            return slice(None), x
+
+        # Same grid as np.arange, computed only for the pixels in the window
+        delta = (crval1+cdelt1)-crval1
+        lim = []
+        for w, default in [(self._xmin, 0), (self._xmax, n)]:
+            if w is None:
+                lim.append(default)
+            else:
+                w = np.log10((w*au.nm).to_value(au.Angstrom))
+                lim.append(int(np.floor((w-crval1)/delta)))
+        i0 = min(max(lim[0]-2, 0), n)
+        i1 = max(min(lim[1]+3, n), i0)
+        return slice(i0, i1), 10**(crval1+np.arange(i0, i1)*delta)
 
     def _create_xmin_xmax(self, x):
         mean = 0.5*(x[1:]+x[:-1])
@@ -21,6 +84,8 @@ class Format(object):
     def astrocook(self, hdul, struct):
         hdr = hdul[1].header
         data = hdul[1].data
+        if struct in ['spec', 'nodes']:
+            data = data[self._rows(data['x'], au.nm)]
 
         if struct in ['spec', 'nodes', 'lines']:
 
@@ -38,19 +103,23 @@ class Format(object):
                 meta['object'] = ''
                 print(prefix, "HIERARCH ESO OBS TARG NAME not defined.")
             if struct in ['spec', 'nodes']:
-                out = Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta)
+                out = Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta,
+                               copy=self._copy)
             if struct in ['lines']:
-                out = LineList(x, xmin, xmax, y, dy, xunit, yunit, meta)
+                out = LineList(x, xmin, xmax, y, dy, xunit, yunit, meta,
+                               copy=self._copy)
 
             # Additional columns
             if struct in ['spec']:
                 try:
-                    out._t['cont'] = data['cont']
+                    out._t.add_column(data['cont'], name='cont',
+                                      copy=self._copy)
                     out._t['cont'].unit = out._t['y'].unit
                 except:
                     pass
                 try:
-                    out._t['conv'] = data['conv']
+                    out._t.add_column(data['conv'], name='conv',
+                                      copy=self._copy)
                     out._t['conv'].unit = out._t['y'].unit
                 except:
                     pass
@@ -59,12 +128,14 @@ class Format(object):
                 except:
                     pass
                 try:
-                    out._t['model'] = data['model']
+                    out._t.add_column(data['model'], name='model',
+                                      copy=self._copy)
                     out._t['model'].unit = out._t['y'].unit
                 except:
                     pass
                 try:
-                    out._t['deabs'] = data['deabs']
+                    out._t.add_column(data['deabs'], name='deabs',
+                                      copy=self._copy)
                     out._t['deabs'].unit = out._t['y'].unit
                 except:
                     pass
@@ -93,6 +164,7 @@ class Format(object):
 
         hdr = hdul[1].header
         data = hdul[1].data
+        data = data[self._rows(data['wave'], au.Angstrom)]
         x = data['wave']
         xmin = x-data['wpix']*0.5
         xmax = x+data['wpix']*0.5
@@ -117,13 +189,15 @@ class Format(object):
         except:
             meta['object'] = ''
             print(prefix, "HIERARCH ESO OBS TARG NAME not defined.")
-        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta, cont=cont)
+        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta, cont=cont,
+                        copy=self._copy)
 
     def espresso_das_spectrum(self, hdul):
         """ ESPRESSO DAS FSPEC/RSPEC format """
 
         hdr = hdul[0].header
         data = hdul[1].data
+        data = data[self._rows(data['WAVEL'], au.nm)]
         x = data['WAVEL']
         xmin = x-data['PIXSIZE']*0.5
         xmax = x+data['PIXSIZE']*0.5
@@ -137,13 +211,15 @@ class Format(object):
         except:
             meta['object'] = ''
             print(prefix, "HIERARCH ESO OBS TARG NAME not defined.")
-        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta)
+        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta,
+                        copy=self._copy)
 
     def espresso_drs_spectrum(self, hdul):
         """ ESPRESSO DRS S1D format """
 
         hdr = hdul[0].header
         data = hdul[1].data
+        data = data[self._rows(data['wavelength'], au.Angstrom)]
         x = data['wavelength']
         xmin, xmax = self._create_xmin_xmax(x)
         y = data['flux']/(xmax-xmin)#*10#au.nm/au.Angstrom
@@ -156,7 +232,8 @@ class Format(object):
         except:
             meta['object'] = ''
             print(prefix, "HIERARCH ESO OBS TARG NAME not defined.")
-        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta)
+        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta,
+                        copy=self._copy)
 
     def espresso_spectrum_format(self, data):
         """ ESPRESSO spectrum format """
@@ -169,7 +246,8 @@ class Format(object):
         xunit = au.nm
         yunit = None
         meta = {}
-        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta)
+        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta,
+                        copy=self._copy)
 
     def uves_popler_spectrum(self, hdul):
         """ UVES POPLER format """
@@ -179,10 +257,10 @@ class Format(object):
         cdelt1 = hdr['CDELT1']
         naxis1 = hdr['NAXIS1']
         data = hdul[0].data
-        y = data[:][0]#*data[:][3]
+        rows, x = self._pixels(crval1, cdelt1, naxis1, data.shape[-1])
+        y = data[:][0][rows]#*data[:][3]
         #dy = data[:][1]#*data[:][3]
-        dy = data[:][2]#*data[:][3]
-        x = 10**np.arange(crval1, crval1+naxis1*cdelt1, cdelt1)[:len(y)]
+        dy = data[:][2][rows]#*data[:][3]
         xmin, xmax = self._create_xmin_xmax(x)
         xunit = au.Angstrom
         yunit = au.electron/au.Angstrom
@@ -192,7 +270,8 @@ class Format(object):
         except:
             meta['object'] = ''
             print(prefix, "OBJECT not defined.")
-        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta)
+        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta,
+                        copy=self._copy)
 
     def xshooter_reduce_spectrum(self, hdul, hdul_e):
         hdr = hdul[0].header
@@ -201,9 +280,9 @@ class Format(object):
         naxis1 = hdr['NAXIS1']
         data = hdul[0].data
         data_e = hdul_e[0].data
-        y = data
-        dy = data_e
-        x = 10**np.arange(crval1, crval1+naxis1*cdelt1, cdelt1)[:len(y)]
+        rows, x = self._pixels(crval1, cdelt1, naxis1, len(data))
+        y = data[rows]
+        dy = data_e[rows]
         xmin, xmax = self._create_xmin_xmax(x)
         xunit = au.Angstrom
         yunit = au.electron/au.Angstrom
@@ -213,4 +292,5 @@ class Format(object):
         except:
             meta['object'] = ''
             print(prefix, "OBJECT not defined.")
-        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta)
+        return Spectrum(x, xmin, xmax, y, dy, xunit, yunit, meta,
+                        copy=self._copy)
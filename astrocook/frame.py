@@ -1,4 +1,5 @@
 from .message import *
+from .table_buffer import TableBuffer
 from astropy import units as au
 from astropy import constants as aconst
 from astropy import table as at
@@ -8,6 +9,16 @@ import numpy as np
 
 prefix = "Frame:"
 
+class _ViewCache(dict):
+    """ Cache of views of the columns of a table. Views are not copied with
+    the frame: they are created again on demand. """
+
+    def __deepcopy__(self, memo):
+        return _ViewCache()
+
+    def __reduce__(self):
+        return (_ViewCache, ())
+
 class Frame():
     """Class for frames.
 
@@ -17,6 +28,11 @@ class Frame():
         -# @xmax: upper limit for each channel;
         -# @y: flux density in the channel;
         -# @dy: error on @y.
+
+    Channels are stored as wavelengths in nm, and never rewritten when the
+    x axis is converted to other units or shifted to the rest frame: @x,
+    @xmin and @xmax are views of the stored wavelengths in the current unit,
+    emission redshift and rest-frame redshift of the frame.
     """
 
     def __init__(self,
@@ -27,23 +43,29 @@ class Frame():
                  dy=[],
                  xunit=au.nm,
                  yunit=au.erg/au.cm**2/au.s/au.nm,
-                 meta={},
-                 dtype=float):
+                 meta=None,
+                 dtype=float,
+                 copy=True):
 
+        self._xunit = xunit
+        self._zem = 0.0
+        self._rfz = 0.0
+
+        # With copy=False, arrays (e.g. memory-mapped from a file) are used
+        # as columns without copying them
+        x, xmin, xmax = [self._x_stored(np.array(v, ndmin=1, copy=copy), xunit)
+                         for v in [x, xmin, xmax]]
         t = at.Table()
-        t['x']  = at.Column(np.array(x, ndmin=1), dtype=dtype, unit=xunit)
-        t['xmin'] = at.Column(np.array(xmin, ndmin=1), dtype=dtype, unit=xunit)
-        t['xmax'] = at.Column(np.array(xmax, ndmin=1), dtype=dtype, unit=xunit)
-        t['y']  = at.Column(np.array(y, ndmin=1) , dtype=dtype, unit=yunit)
-        t['dy'] = at.Column(np.array(dy, ndmin=1), dtype=dtype, unit=yunit)
+        for n, v, u in [('x', x, au.nm), ('xmin', xmin, au.nm),
+                        ('xmax', xmax, au.nm), ('y', y, yunit),
+                        ('dy', dy, yunit)]:
+            t.add_column(self._column(v, u, dtype, copy), name=n, copy=False)
         self._t = t
-        self._xunit = xunit
         self._yunit = yunit
-        self._meta = meta
+        self._meta = {} if meta is None else meta
         self._dtype = dtype
-        self._rfz = 0.0
-
-        self.x = au.Quantity(self._t['x'])
+        self._t_buf = TableBuffer()
+        self._view_d = _ViewCache()
 
     @property
     def t(self):
@@ -51,23 +73,23 @@ class Frame():
 
     @property
     def x(self):
-        return au.Quantity(self._t['x'])
+        return self._view_x('x')
 
     @property
     def xmin(self):
-        return au.Quantity(self._t['xmin'])
+        return self._view_x('xmin')
 
     @property
     def xmax(self):
-        return au.Quantity(self._t['xmax'])
+        return self._view_x('xmax')
 
     @property
     def y(self):
-        return au.Quantity(self._t['y'])
+        return self._view('y')
 
     @property
     def dy(self):
-        return au.Quantity(self._t['dy'])
+        return self._view('dy')
 
     @property
     def meta(self):
@@ -75,18 +97,18 @@ class Frame():
 
     @x.setter
     def x(self, val, dtype=float):
-        self._t['x'] = np.array(val, dtype=dtype)
-        self._t['x'].unit = val.unit
+        self._t['x'] = np.array(self._x_stored(val), dtype=dtype)
+        self._t['x'].unit = au.nm
 
     @xmin.setter
     def xmin(self, val, dtype=float):
-        self._t['xmin'] = np.array(val, dtype=dtype)
-        self._t['xmin'].unit = val.unit
+        self._t['xmin'] = np.array(self._x_stored(val), dtype=dtype)
+        self._t['xmin'].unit = au.nm
 
     @xmax.setter
     def xmax(self, val, dtype=float):
-        self._t['xmax'] = np.array(val, dtype=dtype)
-        self._t['xmax'].unit = val.unit
+        self._t['xmax'] = np.array(self._x_stored(val), dtype=dtype)
+        self._t['xmax'].unit = au.nm
 
     @y.setter
     def y(self, val, dtype=float):
@@ -103,21 +125,46 @@ class Frame():
         self._meta[key] = val
 
     def _append(self, frame):
-        vstack = at.vstack([self._t, frame._t])
-        self._t = at.unique(vstack, keys=['x'])
+        self._t = self._t_buf._append(self._t, frame._t, keys=['x'])
         return 0
 
-    def _convert_x(self, zem=0, xunit=au.km/au.s):
+    def _column(self, val, unit, dtype=float, copy=True):
+        """ @brief Create a column.
+        @param val Values
+        @param unit Unit
+        @param dtype Data type
+        @param copy Copy the values. If False, arrays are used without copying
+        them when they differ from dtype only in byte order (as the arrays
+        read from FITS files)
+        @return Column
+        """
 
-        xem = (1+zem) * 121.567*au.nm
-        equiv = [(au.nm, au.km/au.s,
-                  lambda x: np.log(x/xem.value)*aconst.c.to(au.km/au.s),
-                  lambda x: np.exp(x/aconst.c.to(au.km/au.s).value)*xem.value)]
+        val = np.array(val, ndmin=1, copy=copy)
+        if not copy and val.dtype.newbyteorder('=') == np.dtype(dtype):
+            dtype = val.dtype
+        return at.Column(val, dtype=dtype, unit=unit, copy=copy)
+
+    def _convert_x(self, zem=0, xunit=au.km/au.s):
+        """ @brief Convert the x axis to wavelength or velocity units. The
+        stored wavelengths are not changed: only the views are.
+        @param zem Emission redshift, to use as a 0-point for velocities
+        @param xunit Unit of wavelength or velocity
+        @return 0
+        """
 
+        self._zem = zem
         self._xunit = xunit
-        self.x = self.x.to(xunit, equivalencies=equiv)
-        self.xmin = self.xmin.to(xunit, equivalencies=equiv)
-        self.xmax = self.xmax.to(xunit, equivalencies=equiv)
+        return 0
+
+    def _convert_x_as(self, frame):
+        """ @brief Convert the x axis as the one of another frame (unit,
+        emission redshift and rest frame).
+        @param frame Frame
+        @return 0
+        """
+
+        self._convert_x(frame._zem, frame._xunit)
+        self._shift_rf(frame._rfz)
         return 0
 
     def _convert_y(self, e_to_flux=None, yunit=au.erg/au.cm**2/au.s/au.nm):
@@ -144,16 +191,18 @@ class Frame():
         """
         if sel is None:
             sel = range(len(self.t))
-        x = dc(self.x[sel])
-        xmin = dc(self.xmin[sel])
-        xmax = dc(self.xmax[sel])
+        x = self._view('x')[sel]
+        xmin = self._view('xmin')[sel]
+        xmax = self._view('xmax')[sel]
         y = dc(self.y[sel])
         dy = dc(self.dy[sel])
-        xunit = self._xunit
+        xunit = self._t['x'].unit
         yunit = self._yunit
         meta = self._meta
         dtype = self._dtype
-        return type(self)(x, xmin, xmax, y, dy, xunit, yunit, meta, dtype)
+        copy = type(self)(x, xmin, xmax, y, dy, xunit, yunit, meta, dtype)
+        copy._convert_x_as(self)
+        return copy
 
     def _extract_region(self, xmin, xmax):
         """ @brief Extract a spectral region as a new frame.
@@ -178,19 +227,108 @@ class Frame():
 
     def _safe(self, col):
         if isinstance(col, at.Column):
-            col = au.Quantity(col)
-        self._where_safe = ~np.isnan(col.value)
+            col = au.Quantity(col, copy=False)
+        self._where_safe = ~np.isnan(np.asarray(col))
         return col[self._where_safe]
 
+    def _view(self, col):
+        """ @brief Read-only view of a column as a Quantity, without copying
+        the data. The view is cached, and created again only when the column
+        is replaced or its unit is changed.
+        @param col Column name
+        @return Quantity
+        """
+
+        c = self._t[col]
+        try:
+            c_v, unit_v, view = self._view_d[col]
+            if c_v is c and unit_v is c.unit:
+                return view
+        except KeyError:
+            pass
+        view = au.Quantity(c, copy=False)
+        if np.may_share_memory(view, c):
+            view.flags.writeable = False
+            self._view_d[col] = (c, c.unit, view)
+        return view
+
     def _shift_rf(self, z):
-        """ @brief Shift to and from rest frame.
+        """ @brief Shift to and from rest frame. The stored wavelengths are
+        not changed: only the views are.
         @param z Redshift to use for shifting
         @return 0
         """
 
-        fact = (1+self._rfz)/(1+z)
-        self.x = self.x*fact
-        self.xmin = self.xmin*fact
-        self.xmax = self.xmax*fact
         self._rfz = z
         return 0
+
+    def _view_x(self, col, zem=None, xunit=None, rfz=None):
+        """ @brief View of a wavelength column in a unit of wavelength or
+        velocity, possibly in the rest frame. Views other than the stored
+        wavelengths are computed when first requested and cached, until the
+        column is replaced or its unit is changed.
+        @param col Column name
+        @param zem Emission redshift, to use as a 0-point for velocities
+        (default: the one of the frame)
+        @param xunit Unit of wavelength or velocity (default: the one of the
+        frame)
+        @param rfz Redshift of the rest frame (default: the one of the frame)
+        @return Quantity
+        """
+
+        zem = self._zem if zem is None else zem
+        xunit = self._xunit if xunit is None else au.Unit(xunit)
+        rfz = self._rfz if rfz is None else rfz
+        c = self._t[col]
+        if rfz == 0 and xunit == c.unit:
+            return self._view(col)
+        if xunit.is_equivalent(au.nm):
+            zem = 0
+        key = (col, zem, xunit, rfz)
+        try:
+            c_v, unit_v, view = self._view_d.pop(key)
+            if c_v is c and unit_v is c.unit:
+                self._view_d[key] = (c_v, unit_v, view)
+                return view
+        except KeyError:
+            pass
+
+        x = au.Quantity(c, copy=False).to_value(au.nm)
+        if rfz != 0:
+            x = x/(1+rfz)
+        if xunit.is_equivalent(au.nm):
+            view = au.Quantity(x, au.nm, copy=False).to(xunit)
+        else:
+            xem = (1+zem) * 121.567
+            view = (np.log(x/xem)*aconst.c.to(au.km/au.s)).to(xunit)
+        view.flags.writeable = False
+
+        # Only the last views of each column are kept
+        keys = [k for k in self._view_d if type(k) == tuple and k[0] == col]
+        for k in keys[:-3]:
+            del self._view_d[k]
+        self._view_d[key] = (c, c.unit, view)
+        return view
+
+    def _x_stored(self, x, xunit=None):
+        """ @brief Convert values of x from a unit of wavelength or velocity
+        (in the emission redshift and rest frame of the frame) to stored
+        wavelengths.
+        @param x Values, as a Quantity or in unit xunit
+        @param xunit Unit of the values, if they are not a Quantity
+        (default: the one of the frame)
+        @return Wavelengths (nm)
+        """
+
+        if isinstance(x, au.Quantity):
+            x, xunit = x.value, x.unit
+        xunit = self._xunit if xunit is None else au.Unit(xunit)
+        if xunit.is_equivalent(au.nm):
+            x = au.Quantity(x, xunit, copy=False).to_value(au.nm)
+        else:
+            xem = (1+self._zem) * 121.567
+            v = au.Quantity(x, xunit, copy=False).to_value(au.km/au.s)
+            x = np.exp(v/aconst.c.to(au.km/au.s).value)*xem
+        if self._rfz != 0:
+            x = x*(1+self._rfz)
+        return x
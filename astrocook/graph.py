@@ -254,6 +254,7 @@ class GraphSpectrumXYMask(GraphSpectrumXY):
     def __init__(self, sess, norm=False):
         super(GraphSpectrumXYMask, self).__init__(sess)
         self._type = 'scatter'
+        self._x = self._x.copy()
         self._x[sess.spec._t['lines_mask']] = np.nan
         self._kwargs = {'label':sess.name+", masked"}
 
@@ -283,8 +284,7 @@ class GraphSystListZSeries(object):
         series_unkn = series_flat[unkn]
         #print(z_flat[unkn])
         #print(series_flat[unkn])
-        xem_kn = np.array([xem_d[sf].to(au.nm).value for sf in series_kn])\
-                   *au.nm
+        xem_kn = atom_t['xem'][[trans_i_d[sf] for sf in series_kn]]*au.nm
         #print(xem_kn)
         self._x = (1.+z_kn)*xem_kn
         self._xalt = z_unkn * au.nm
@@ -96,7 +96,7 @@ class GUIPanelSession(wx.Frame):
         self.Show()
         self.Bind(wx.EVT_CLOSE, self._on_close)
 
-    def _on_add(self, sess, open=True):
+    def _on_add(self, sess, open=True, **kwargs):
         # _sel is the last selection; _items is the list of all selections.
         self._sel = self._tab.GetItemCount()
         self._items = [self._sel]
@@ -110,7 +110,7 @@ class GUIPanelSession(wx.Frame):
         self._gui._sess_sel = self._gui._sess_list[self._sel]
         self._gui._sess_items = [self._gui._sess_sel]
         if open:
-            self._gui._sess_sel.open()
+            self._gui._sess_sel.open(**kwargs)
         x = sess.spec._safe(sess.spec.x)#.value
         self._refresh()
         self._gui._graph_main._refresh(self._gui._sess_items)
@@ -119,14 +119,15 @@ class GUIPanelSession(wx.Frame):
     def _on_edit(self, event):
         self._gui._sess_list[self._sel].spec.meta['object'] = event.GetLabel()
 
-    def _on_open(self, path):
-        """ Behaviour for Session > Open """
+    def _on_open(self, path, **kwargs):
+        """ Behaviour for Session > Open. Keyword arguments are passed to
+        Session.open (e.g. to open only a region). """
 
         #name = path.split('/')[-1][:-5]
         name = path.split('/')[-1].split('.')[0]
         print(prefix, "I'm loading session %s..." % path)
         sess = Session(path=path, name=name)
-        self._gui._panel_sess._on_add(sess, open=True)
+        self._gui._panel_sess._on_add(sess, open=True, **kwargs)
 
     def _on_close(self, event):
         print("AC: Bye!")
@@ -79,7 +79,8 @@ class GUIGraphDetail(GUIGraphMain):
 
     def _define_lim(self, x, t=None, xspan=30, ymargin=0.1):
         if t == None:
-            t = self._gui._sess_sel.spec.t
+            spec = self._gui._sess_sel.spec
+            t = {'x': spec.x.value, 'y': spec.y.value}
         w = np.argmin(np.abs(t['x']-x))
         xmin = t['x'][w-xspan]
         xmax = t['x'][w+xspan]
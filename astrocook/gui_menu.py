@@ -113,7 +113,7 @@ class GUIMenuCook(GUIMenu):
             sess_center.add_syst_from_lines(z_end=20, maxfev=10)#series='unknown')
 
             sess_reg.lines.t['x'] = (1+sess_center.systs.t['z'])\
-                                    *xem_d['Ly_a'].to(sess_reg.spec.x.unit)
+                                    *xem_d['Ly_a'].to(au.nm)
             sess_reg.lines.t['logN'] = sess_center.systs.t['logN']
 
             #sess_reg.add_syst_from_lines(series='SiII', logN=None, b=20.0,
@@ -181,7 +181,7 @@ class GUIMenuCook(GUIMenu):
             sess_center = dc(sess_reg)
             sess_center.add_syst_from_lines(z_end=20, maxfev=10)#series='unknown')
             sess_reg.lines.t['x'] = (1+sess_center.systs.t['z'])\
-                                    *xem_d['Ly_a'].to(sess_reg.spec.x.unit)
+                                    *xem_d['Ly_a'].to(au.nm)
             sess_reg.lines.t['logN'] = sess_center.systs.t['logN']
             #"""
             #sess_reg.add_syst_from_lines(series='SiII', logN=None, b=20.0,
@@ -27,12 +27,21 @@ class GUITable(wx.Frame):
         self._size_y = size_y
 
     def _fill(self):
+        # Wavelengths are shown through the views of the frame (in its unit
+        # and rest frame), not as they are stored in the table
+        views = {n: getattr(self._data, n) for n in ['x', 'xmin', 'xmax']
+                 if n in self._data.t.colnames}
         for j, r in enumerate(self._data.t):
             for i, n in enumerate(self._data.t.colnames):
+                if n in views:
+                    v = views[n][j].value
+                    unit = self._data._xunit
+                else:
+                    v = r[n]
+                    unit = self._data.t[n].unit
                 if j == 0:
                     self._tab.SetColSize(i, 150)
-                    self._tab.SetColLabelValue(i, "%s\n%s" \
-                                              % (n, str(self._data.t[n].unit)))
+                    self._tab.SetColLabelValue(i, "%s\n%s" % (n, str(unit)))
                 """
                 try:
                     self._tab.SetCellValue(j, i, "%3.5f" % r[n])
@@ -44,16 +53,16 @@ class GUITable(wx.Frame):
                     if type(r[n]) == dict:
                         self._tab.SetCellValue(j, i, pprint.pformat(r[n]))
                 """
-                if type(r[n]) == np.int64:
-                    self._tab.SetCellValue(j, i, "%4i" % r[n])
-                elif type(r[n]) == str:
-                    self._tab.SetCellValue(j, i, r[n])
-                elif type(r[n]) == OrderedDict:
-                    self._tab.SetCellValue(j, i, pprint.pformat(r[n]))
-                elif type(r[n]) == dict:
-                    self._tab.SetCellValue(j, i, pprint.pformat(r[n]))
+                if type(v) == np.int64:
+                    self._tab.SetCellValue(j, i, "%4i" % v)
+                elif type(v) == str:
+                    self._tab.SetCellValue(j, i, v)
+                elif type(v) == OrderedDict:
+                    self._tab.SetCellValue(j, i, pprint.pformat(v))
+                elif type(v) == dict:
+                    self._tab.SetCellValue(j, i, pprint.pformat(v))
                 else:
-                    self._tab.SetCellValue(j, i, "%3.5f" % r[n])
+                    self._tab.SetCellValue(j, i, "%3.5f" % v)
         self._tab.AutoSizeColumns(True)
 
 
@@ -72,9 +81,9 @@ class GUITable(wx.Frame):
         self._gui._graph_det._graph._init_ax(111)
         #row = self._data.t[self._gui._tab_popup._event.GetRow()]
         row = self._data.t[event.GetRow()]
-        self._gui._sess_sel._xdet = row['x']
+        x = self._data.x[event.GetRow()].value
+        self._gui._sess_sel._xdet = x
         self._gui._sess_sel._ydet = row['y']
-        x = row['x']
         xlim, ylim = self._gui._graph_det._define_lim(x)
         self._gui._graph_split = False
         self._gui._graph_det._refresh(self._gui._sess_items, xlim=xlim,
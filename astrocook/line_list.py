@@ -16,10 +16,11 @@ class LineList(Frame):
                  dy=[],
                  xunit=au.nm,
                  yunit=au.erg/au.cm**2/au.s/au.nm,
-                 meta={},
-                 dtype=float):
+                 meta=None,
+                 dtype=float,
+                 copy=True):
         super(LineList, self).__init__(x, xmin, xmax, y, dy, xunit, yunit, meta,
-                                       dtype)
+                                       dtype, copy)
 
     def _copy(self, sel=None):
         copy = super(LineList, self)._copy(sel)
@@ -51,15 +52,16 @@ class LineList(Frame):
 
         # Compute all possible redshifts
         trans = series_d[series]
+        par = atom_t[series_i_d[series]]
+        x = self.x.to_value(au.nm)
         if series == 'unknown':
-            z_all = np.ravel([[self.x.to(au.nm)] for t in trans])
+            z_all = np.ravel([[x] for t in trans])
         else:
-            z_all = np.ravel([[(x.to(au.nm)/xem_d[t].to(au.nm)).value-1. \
-                                for x in self.x] for t in trans])
+            z_all = np.ravel(x/par['xem'][:, np.newaxis]-1.)
         y_all = np.ravel([[self.y] for t in trans])
         if logN:
-            fosc_r = np.ravel([[fosc_d['Ly_a']/fosc_d[t]]*len(self.x) \
-                               for t in trans])
+            fosc_r = np.repeat(atom_t['fosc'][trans_i_d['Ly_a']]/par['fosc'],
+                               len(x))
             logN_all = np.ravel([[self.t['logN']] for t in trans]) \
                        + np.log10(fosc_r)
             #print('all')
@@ -1,3 +1,4 @@
+from .table_buffer import TableBuffer
 from astropy import table as at
 import numpy as np
 
@@ -21,12 +22,12 @@ class ModelList(object):
         t['id'] = at.Column(np.array(id, ndmin=1), dtype=object)
         self._t = t
         self._dtype = dtype
+        self._t_buf = TableBuffer()
 
     @property
     def t(self):
         return self._t
 
     def _append(self, frame):
-        vstack = at.vstack([self._t, frame._t])
-        self._t = at.unique(vstack, keys=['z0'])
+        self._t = self._t_buf._append(self._t, frame._t, keys=['z0'])
         return 0
@@ -11,15 +11,21 @@ from .syst_model import SystModel
 #from .model_list import ModelList
 from .vars import *
 #from astropy import constants as ac
+from astropy import table as at
 from astropy import units as au
 from astropy.io import ascii, fits
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy as dc
+import io
 from matplotlib import pyplot as plt
 import numpy as np
 import os
 from scipy.signal import argrelmin
+import shutil
 import tarfile
+import tempfile
 import time
+import weakref
 
 prefix = "Session:"
 
@@ -59,7 +65,7 @@ class Session(object):
 
         spec = self.spec
 
-        self.systs._xs = np.array(spec._safe(spec.x).to(au.nm))
+        self.systs._xs = spec._safe(spec.x).to_value(au.nm)
         s = spec._where_safe
 
         y = spec.y
@@ -111,7 +117,7 @@ class Session(object):
 
     def add_syst_from_lines(self, series='Ly_a', z_start=0, z_end=6,
                             dz=1e-4, logN=13, b=10, resol=45000,
-                            chi2r_thres=np.inf, maxfev=100):
+                            chi2r_thres=np.inf, maxfev=100, n_proc=1):
         """ @brief Add and fit Voigt models to a line list, given a redshift
         range.
         @param series Series of transitions
@@ -123,6 +129,8 @@ class Session(object):
         @param resol Resolution
         @param chi2r_thres Reduced chi2 threshold to accept the fitted model
         @param maxfev Maximum number of function evaluation
+        @param n_proc Number of processes to fit independent models (0 to use
+        all the cores)
         @return 0
         """
 
@@ -138,6 +146,7 @@ class Session(object):
         chi2r_thres = float(chi2r_thres)
         resol = float(resol)
         maxfev = int(maxfev)
+        n_proc = int(n_proc)
 
         if logN is None:
             z_range, logN_range = self.lines._syst_cand(series, z_start, z_end,
@@ -181,13 +190,18 @@ class Session(object):
                   "redshift %2.4f and %2.4f." % (len(z_range), series,
                   len(mods_t), z_range[0], z_range[-1]))
 
-        if maxfev > 0:
+        if maxfev > 0 and n_proc == 1:
             #print(mods_t['z0', 'id'])
             for i,m in enumerate(mods_t):
                 print(prefix, "I'm fitting a %s model at redshift %2.4f "
                       "(%i/%i)..."\
                     % (series, m['z0'], i+1, len(mods_t)), end='\r')
                 self.cb._fit_mod(m['mod'], maxfev)
+        elif maxfev > 0:
+            print(prefix, "I'm fitting %i %s model(s) in parallel..."
+                  % (len(mods_t), series), end='\r')
+            self.cb._fit_mods(list(mods_t['mod']), maxfev, n_proc)
+        if maxfev > 0:
             #print(self.systs._t)
             try:
                 print(prefix, "I've fitted %i %s system(s) in %i model(s) "
@@ -237,6 +251,12 @@ class Session(object):
         old = systs._mods_t[np.where(np.logical_or(
                 systs._mods_t['chi2r'] > chi2r_thres,
                 np.isnan(systs._mods_t['chi2r'])))]
+        # The profile to convolve the residuals and the valid rows of the
+        # residuals do not change while components are added
+        spec = self.spec
+        if len(old) > 0:
+            prof = spec._convolve_gauss_prof(std=2)
+            safe = np.where(~np.isnan(np.asarray(spec._t['deabs'])))[0]
         for i, o in enumerate(old):
             o_id = o['id'][0]
             o_series = systs._t[systs._t['id'] == o_id]['series'][0]
@@ -249,8 +269,6 @@ class Session(object):
 
             while True:
 
-                spec = dc(self.spec)
-                spec._convolve_gauss(std=2, input_col='deabs', verb=False)
                 try:
                 #    ciao
                 #except:
@@ -262,12 +280,20 @@ class Session(object):
                     #print(" ")
                     #reg_x = systs._mods_t['mod'][i-1]._xm
                     #reg_x = o['mod']._xm
+                if len(reg_x) == 0:
+                    break
 
-                reg_xmin = np.interp(reg_x, spec.x.to(au.nm), spec.xmin.to(au.nm))
-                reg_xmax = np.interp(reg_x, spec.x.to(au.nm), spec.xmax.to(au.nm))
-                reg_y = np.interp(reg_x, spec.x.to(au.nm), spec.t['conv']-spec.t['cont'])
+                # Residuals are convolved only within the region of the model,
+                # without copying the spectrum
+                w, conv = spec._convolve_gauss_win(
+                    np.min(reg_x), np.max(reg_x), prof, safe, input_col='deabs')
+                x_w = spec.x.to_value(au.nm)[w]
+                reg_xmin = np.interp(reg_x, x_w, spec.xmin.to_value(au.nm)[w])
+                reg_xmax = np.interp(reg_x, x_w, spec.xmax.to_value(au.nm)[w])
+                reg_y = np.interp(reg_x, x_w,
+                                  conv-np.array(spec.t['cont'])[w])
                 #plt.scatter(reg_x, np.ones(len(reg_x)))
-                reg_dy = np.interp(reg_x, spec.x.to(au.nm), spec.dy)
+                reg_dy = np.interp(reg_x, x_w, np.array(spec.dy)[w])
                 reg = Spectrum(reg_x, reg_xmin, reg_xmax, reg_y, reg_dy)
                 peaks = reg._find_peaks(col='y')#, mode='wrap')
                 #print(peaks.t)
@@ -292,27 +318,29 @@ class Session(object):
                 if z_alt == None:
                     #print("yeh")
                     z_alt = (1.+o_z)\
-                            *xem_d[series_d[o_series][0]].to(au.nm).value
+                            *atom_t['xem'][series_i_d[o_series][0]]
 
                 # Randomize
                 #z_cand = z_cand+np.random.normal(scale=0.0005)
                 #z_alt = z_alt+np.random.normal(scale=0.0005)
 
-                if count == 0:
-                    t_old, mods_t_old = self.systs._freeze()
-                systs._append(SystList(id_start=np.max(self.systs._t['id'])+1),
-                              unique=False)
-                cand = dc(self)
-                alt = dc(self)
-
-                cand_mod = cand.cb._fit_syst(o_series, z_cand, logN, b, resol, maxfev)
-                alt_mod = alt.cb._fit_syst('unknown', z_alt, logN, b, resol, maxfev)
+                # Candidate and alternative components are fitted in turn on
+                # the system list; only the rows changed by each fit are
+                # recorded, to restore them and to adopt the best fit
+                self.systs._trial_start()
+                cand_mod = self.cb._fit_syst(o_series, z_cand, logN, b, resol,
+                                             maxfev)
+                cand_state = self.systs._trial_stop()
+                self.systs._trial_set(cand_state[0])
+                self.systs._trial_start()
+                alt_mod = self.cb._fit_syst('unknown', z_alt, logN, b, resol,
+                                            maxfev)
+                alt_state = self.systs._trial_stop()
                 """
                 print(cand_mod._chi2r, alt_mod._chi2r,
                       cand_mod._aic, alt_mod._aic,
                       cand_mod._bic, alt_mod._bic)
                 """
-                self.systs._mods_t = dc(mods_t_old)
                 #chi2r_cand = cand.systs._t['chi2r'][cand.systs._t['id']==o_id][0]
                 #chi2r_alt = alt.systs._t['chi2r'][alt.systs._t['id']==o_id][0]
                 chi2r_cand = cand_mod._chi2r
@@ -340,22 +368,21 @@ class Session(object):
                 #    and count_good > 5) \
                 #    or (cand_mod._chi2r<10 or alt_mod._chi2r<10):
                 if cand_mod._chi2r>=chi2r_old and alt_mod._chi2r>= chi2r_old:
-                    self.systs._unfreeze(t_old, mods_t_old)
+                    self.systs._trial_set(alt_state[0])
                     #mod._bic = bic_old
                     count += 1
                     #if chi2r < 10:
                     break
                 else:
-                    t_old, mods_t_old = self.systs._freeze()
                     if chi2r_cand > chi2r_alt:#*2:#1.1:# and count > 3:
-                        mod = self.cb._fit_syst('unknown', z_alt, logN, b, resol, maxfev)
                         #self.systs._add('unknown', z_alt, logN, b, resol)
                         #self.systs._update(alt_mod)
                         msg = "added an unknown component at wavelength %2.4f" \
                               % z_alt
                         chi2r = chi2r_alt
                     else:
-                        mod = self.cb._fit_syst(o_series, z_cand, logN, b, resol, maxfev)
+                        self.systs._trial_set(alt_state[0])
+                        self.systs._trial_set(cand_state[1])
                         #self.systs._add(o_series, z_cand, logN, b, resol)
                         #self.systs._update(cand_mod)
                         msg = "added a %s component at redshift %2.4f" \
@@ -428,20 +455,21 @@ class Session(object):
         maxfev = int(maxfev)
 
         #z_range = np.arange(z_start, z_end, z_step)
-        z_range = np.array(self.spec.x/xem_d[series_d[series][0]]-1)
-        z_min = np.max([(np.min(self.spec.x.to(au.nm))/xem_d[t]).value-1.0 \
-                        for t in series_d[series]])
-        z_max = np.min([(np.max(self.spec.x.to(au.nm))/xem_d[t]).value-1.0 \
-                        for t in series_d[series]])
+        x = self.spec.x.to_value(au.nm)
+        xem = atom_t['xem'][series_i_d[series]]
+        z_range = x/xem[0]-1
+        z_min = np.max(np.min(x)/xem)-1.0
+        z_max = np.min(np.max(x)/xem)-1.0
         z_range = z_range[np.where(np.logical_and(z_range > z_min,
                                                   z_range < z_max))]
         z_mean = 0.5*(z_min+z_max)
         logN_range = np.arange(logN_start, logN_end, logN_step)
         b_range = np.arange(b_start, b_end, b_step)
 
-        # Create x-swapped spectrum to monitor correctness
-        sess = dc(self)
-        sess.spec._t['x'] = sess.spec._t['x'][::-1]
+        # Sort and normalize the spectrum once, together with an x-swapped
+        # copy to monitor correctness
+        spec_s = self.cb._sort_spec(col)
+        spec_swap_s = self.cb._sort_spec(col, swap=True)
 
         # Previously fitted systems are left fixed...
         systs_old = dc(self.systs)
@@ -464,25 +492,16 @@ class Session(object):
                 icorr = ilogN*len(b_range)+ib
                 xm, ym, ym_0, ym_1, ym_2 = self.cb._create_doubl(series, z_mean,
                                                                  logN, b, resol)
-                cond_c = 0
-                cond_swap_c = 0
-                chi2_arr = []
-                chi2_0_arr = []
-                for iz, z in enumerate(z_range):
-                    print(prefix, "I'm testing a %s system (logN=%2.2f, "
-                          "b=%2.2f) at redshift %2.4f (%i/%i)..." \
-                          % (series, logN, b, z, iz+1, len(z_range)), end='\r')
-                    cond, chi2, chi2_0 = \
-                        self.cb._test_doubl(xm*(1+z), ym, ym_0, ym_1, ym_2, col)
-                    cond_swap, _, _ = \
-                        sess.cb._test_doubl(xm*(1+z), ym, ym_0, ym_1, ym_2, col)
-                    chi2_arr.append(chi2)
-                    chi2_0_arr.append(chi2_0)
-                    if cond:
-                        chi2a[ilogN, ib, iz] = chi2
-                        cond_c += 1
-                    if cond_swap:
-                        cond_swap_c += 1
+                print(prefix, "I'm testing a %s system (logN=%2.2f, "
+                      "b=%2.2f) between redshift %2.4f and %2.4f..." \
+                      % (series, logN, b, z_range[0], z_range[-1]), end='\r')
+                cond, chi2, _ = self.cb._scan_doubl(
+                    *spec_s, xm, ym, ym_0, ym_1, ym_2, z_range)
+                cond_swap, _, _ = self.cb._scan_doubl(
+                    *spec_swap_s, xm, ym, ym_0, ym_1, ym_2, z_range)
+                chi2a[ilogN, ib, cond] = chi2[cond]
+                cond_c = np.sum(cond)
+                cond_swap_c = np.sum(cond_swap)
                 #self.corr[ilogN, ib] = (cond_c, cond_swap_c)
 
                 self.corr[icorr, 0] = logN
@@ -550,7 +569,8 @@ class Session(object):
                    z_start=0, z_end=6, z_step=1e-2,
                    logN_start=15, logN_end=10, logN_step=-0.2,
                    b_start=8, b_end=9, b_step=1.1,
-                   resol=45000, col='y', chi2r_thres=2, maxfev=100):
+                   resol=45000, col='y', chi2r_thres=2, maxfev=100, seed=0,
+                   n_proc=1):
         """ @brief Estimate the completeness of system detection by simulating
         systems at random redshifts and sliding Voigt models to fit them
         @param series Series of transitions
@@ -568,6 +588,9 @@ class Session(object):
         @param col Column where to test the models
         @param chi2r_thres Reduced chi2 threshold to accept the fitted model
         @param maxfev Maximum number of function evaluation
+        @param seed Random seed of the simulated systems
+        @param n_proc Number of processes to run the realizations (0 to use all
+        the cores)
         @return 0
         """
 
@@ -583,6 +606,8 @@ class Session(object):
         resol = float(resol)
         chi2r_thres = float(chi2r_thres)
         maxfev = int(maxfev)
+        seed = int(seed)
+        n_proc = int(n_proc)
 
         z_start, z_end = self.cb._adapt_z(series, z_start, z_end)
         z_range = np.arange(z_start, z_end, z_step)
@@ -599,19 +624,16 @@ class Session(object):
                         logN_range[0]-logN_step*0.5,
                         logN_range[-1]+logN_step*0.5)
 
-        z_arr = np.array(self.spec.x/xem_d[series_d[series][0]]-1)
+        z_arr = self.spec.x.to_value(au.nm)\
+                /atom_t['xem'][series_i_d[series][0]]-1
         dz = 2e-4
-        compl_sum = 0
-        for iz, (zs, ze) in enumerate(zip(z_range[:-1], z_range[1:])):
 
+        # Templates are created for each cell of the grid; realizations are
+        # then run (in parallel, if required) on the base spectrum
+        cells = []
+        for iz, (zs, ze) in enumerate(zip(z_range[:-1], z_range[1:])):
             for ilogN, logN in enumerate(logN_range):
                 for ib, b in enumerate(b_range):
-                    icompl = (iz*len(logN_range)+ilogN)*len(b_range)+ib
-                    #print(icompl)
-
-                    cond_c = 0
-                    n_ok = 0
-
                     sess.systs = dc(self.systs)
                     sess.cb._append_syst()
                     sess.systs._add(series, z_mean, logN, b+0.5*b_step, resol)
@@ -620,40 +642,24 @@ class Session(object):
                         series, z_mean, logN, b, resol)
                     xm_e, ym_e, ym_0_e, ym_1_e, ym_2_e = sess.cb._create_doubl(
                         series, z_mean, logN, b+0.0*b_step, resol)
+                    cells.append((zs, ze, xm, ym, ym_0, ym_1, ym_2, xm_e,
+                                  ym_e))
+        res = sess.cb._compl_run(self.spec, cells, n, z_arr, dz, seed, col,
+                                 n_proc)
 
-                    n_fail = 0
-                    while n_ok < n:
-                        print(prefix, "I'm estimating completeness of %s "
-                              "systems (z=[%2.2f, %2.2f], logN=%2.2f, b=%2.2f, "
-                              "realization %i/%i)..."
-                              % (series, zs, ze, logN, b, n_ok+1, n), end='\r')
-                        z_rand = np.random.rand()*(ze-zs)+zs
-                        sess.spec = dc(self.spec)
-                        fail = sess.cb._apply_doubl(xm_e*(1+z_rand), ym_e)
-                        #if not fail or 1==1:
-                        n_ok += 1
-                        z_round = round(z_rand, 4)
-                        z_sel = np.where(np.logical_and(
-                            z_arr > z_round-1.5*dz,
-                            z_arr < z_round+1.5*dz))
-                        for z in z_arr[z_sel]:
-                            systs = SystList()
-                            cond, chi2, chi2_0 = sess.cb._test_doubl(
-                                xm*(1+z), ym, ym_0, ym_1, ym_2, col)
-                            if cond and np.abs(z-z_rand)<dz:
-                                cond_c += 1
-                                break
-                        if cond == False:
-                            pass
-                        #else:
-                        #n_fail += 1
-
-                    compl = cond_c/n_ok
+        compl_sum = 0
+        icompl = 0
+        for iz in range(len(z_range)-1):
+            for ilogN, logN in enumerate(logN_range):
+                for ib, b in enumerate(b_range):
+                    cond_c = np.sum([r[0] for r in res[icompl]])
+                    compl = cond_c/n
                     compl_sum += compl
-                    self.compl[icompl, 0] = z_rand
+                    self.compl[icompl, 0] = res[icompl][-1][1]
                     self.compl[icompl, 1] = logN
                     self.compl[icompl, 2] = b
                     self.compl[icompl, 3] = compl
+                    icompl += 1
 
         print(prefix, "I've estimated completeness of %s systems "
               "(z=[%2.2f, %2.2f], logN=[%2.2f, %2.2f], b=[%2.2f, %2.2f]); "
@@ -729,8 +735,8 @@ class Session(object):
             print(prefix, msg_param_fail)
 
         x, xmin, xmax, y, dy = self.spec._extract_nodes(delta_x, xunit)
-        self.nodes = Spectrum(x, xmin, xmax, y, dy, self.spec._xunit,
-                              self.spec._yunit)
+        self.nodes = Spectrum(x, xmin, xmax, y, dy, au.nm, self.spec._yunit)
+        self.nodes._convert_x_as(self.spec)
 
         return 0
 
@@ -792,8 +798,10 @@ class Session(object):
 
         peaks = spec._find_peaks(col, kind, kappa)
 
-        lines = LineList(peaks.x, peaks.xmin, peaks.xmax, peaks.y, peaks.dy,
-                         spec._xunit, spec._yunit, spec._meta)
+        lines = LineList(peaks._t['x'], peaks._t['xmin'], peaks._t['xmax'],
+                         peaks.y, peaks.dy, peaks._t['x'].unit, spec._yunit,
+                         spec._meta)
+        lines._convert_x_as(spec)
 
         if append and self.lines != None:
             self.lines._append(lines)
@@ -853,17 +861,50 @@ class Session(object):
         self.cb._merge_syst(self.merge, v_thres)
         self.merge.sort('z')
 
-    def open(self):
+    def open(self, memmap=False, xmin=None, xmax=None):
+        """ @brief Open a session from a file.
+        @param memmap Map the files in memory instead of reading them. The
+        structures are backed by the files, which are read only where they are
+        accessed; data are copied only when they are modified (the files are
+        never changed). Archives (.acs) are extracted in a temporary directory,
+        which is removed with the session
+        @param xmin Minimum wavelength (nm). If given, only the region from xmin
+        to xmax is read, as with extract_region
+        @param xmax Maximum wavelength (nm)
+        """
+
+        try:
+            xmin = None if xmin is None else float(xmin)
+            xmax = None if xmax is None else float(xmax)
+        except:
+            print(prefix, msg_param_fail)
+            return None
+        if xmin is not None and xmax is not None and xmin > xmax:
+            xmin, xmax = xmax, xmin
+            print(prefix, msg_param_swap)
 
-        format = Format()
+        if memmap:
+            fits_kw = {'memmap': True, 'mode': 'copyonwrite'}
+        else:
+            fits_kw = {}
+        format = Format(copy=not memmap, xmin=xmin, xmax=xmax)
+        root = self.path[:-4]
         if self.path[-3:] == 'acs':
-            root = '/'.join(self.path.split('/')[:-1])
+            # Mapped files are extracted in a temporary directory, removed
+            # with the session, so that they are not overwritten while in use
+            # (e.g. when the same archive is extracted again)
+            if memmap:
+                dir = tempfile.mkdtemp(prefix='astrocook_')
+                weakref.finalize(self, shutil.rmtree, dir, ignore_errors=True)
+                root = os.path.join(dir, os.path.basename(root))
+            else:
+                dir = '/'.join(self.path.split('/')[:-1])
             with tarfile.open(self.path) as arch:
-                arch.extractall(path=root)
-                hdul = fits.open(self.path[:-4]+'_spec.fits')
+                arch.extractall(path=dir)
+                hdul = fits.open(root+'_spec.fits', **fits_kw)
                 hdr = hdul[1].header
         else:
-            hdul = fits.open(self.path)
+            hdul = fits.open(self.path, **fits_kw)
             hdr = hdul[0].header
 
         try:
@@ -902,7 +943,7 @@ class Session(object):
         if orig == 'Astrocook':
             for s in self.seq:
                 try:
-                    hdul = fits.open(self.path[:-4]+'_'+s+'.fits')
+                    hdul = fits.open(root+'_'+s+'.fits', **fits_kw)
                     setattr(self, s, format.astrocook(hdul, s))
                 except:
                     pass
@@ -929,49 +970,89 @@ class Session(object):
 
         # XSHOOTER_REDUCE spectrum
         if instr == 'XSHOOTER' and orig == 'REDUCE':
-            hdul_e = fits.open(self.path[:-5]+'e.fits')
+            hdul_e = fits.open(self.path[:-5]+'e.fits', **fits_kw)
             self.spec = format.xshooter_reduce_spectrum(hdul, hdul_e)
 
+        # Spectra are read only around the region: all structures are cut
+        # exactly to it
+        if xmin is not None or xmax is not None:
+            xmin = -np.inf if xmin is None else xmin
+            xmax = np.inf if xmax is None else xmax
+            for s in self.seq:
+                try:
+                    setattr(self, s, getattr(self, s)._extract_region(
+                        xmin*au.nm, xmax*au.nm))
+                except:
+                    pass
+
 
-    def save(self, path):
+    def _save_struct(self, s):
+        """ @brief Write a structure as a FITS file in memory, straight from
+        the columns of its table (which is neither copied nor changed).
+        @param s Name of the structure
+        @return Buffer with the FITS file, or None if the structure is not
+        saved
+        """
+
+        # As before, only structures with a wavelength column are saved
+        # (wavelengths are always stored in nm)
+        try:
+            obj = getattr(self, s)
+            obj._t['x']
+            meta = obj._meta.copy()
+            meta['ORIGIN'] = 'Astrocook'
+            meta['HIERARCH ASTROCOOK VERSION'] = version
+            meta['HIERARCH ASTROCOOK STRUCT'] = s
+            t = at.Table(meta=meta)
+            for c in obj._t.colnames:
+                t.add_column(at.Column(obj._t[c], copy=False,
+                                       unit=au.dimensionless_unscaled),
+                             name=c, copy=False)
+            buf = io.BytesIO()
+            t.write(buf, format='fits')
+            buf.seek(0)
+            return buf
+        except:
+            return None
+
+    def save(self, path, compress=9, n_thread=0):
+        """ @brief Save the session as an archive (.acs) with a FITS file for
+        each structure. Structures are written in memory by a pool of threads
+        and added to the archive as soon as they are ready, in order.
+        @param path Path of the archive (its extension is replaced by .acs)
+        @param compress Level of gzip compression of the archive, from 1
+        (fastest) to 9 (smallest); 0 to write an uncompressed archive. Both
+        are read by Session.open
+        @param n_thread Number of threads (0 to use all the cores)
+        @return 0
+        """
 
         root = path[:-4]
         stem = root.split('/')[-1]
-        with tarfile.open(root+'.acs', 'w:gz') as arch:
-            for s in self.seq:
+        if 'systs' in self.seq:
+            for a in ['compl', 'corr', 'merge']:
                 try:
-                    if s=='systs':
-                        try:
-                            np.savetxt(root+'_compl.dat', self.compl, fmt='%s')
-                        except:
-                            pass
-                        try:
-                            np.savetxt(root+'_corr.dat', self.corr, fmt='%s')
-                        except:
-                            pass
-                        try:
-                            np.savetxt(root+'_merge.dat', self.merge, fmt='%s')
-                        except:
-                            pass
-                    name = root+'_'+s+'.fits'
-                    obj = dc(getattr(self, s))
-                    t = obj._t
-                    t['x'] = t['x'].to(au.nm)
-                    t['xmin'] = t['xmin'].to(au.nm)
-                    t['xmax'] = t['xmax'].to(au.nm)
-                    t.meta = obj._meta
-                    t.meta['ORIGIN'] = 'Astrocook'
-                    t.meta['HIERARCH ASTROCOOK VERSION'] = version
-                    t.meta['HIERARCH ASTROCOOK STRUCT'] = s
-                    for c in t.colnames:
-                        t[c].unit = au.dimensionless_unscaled
-                    t.write(name, format='fits', overwrite=True)
-                    arch.add(name, arcname=stem+'_'+s+'.fits')
-                    os.remove(name)
-
+                    np.savetxt(root+'_'+a+'.dat', getattr(self, a), fmt='%s')
                 except:
                     pass
 
+        if n_thread < 1:
+            n_thread = os.cpu_count()
+        if compress > 0:
+            kw = {'mode': 'w:gz', 'compresslevel': compress}
+        else:
+            kw = {'mode': 'w'}
+        with tarfile.open(root+'.acs', **kw) as arch, \
+            ThreadPoolExecutor(n_thread) as ex:
+            for s, buf in zip(self.seq, ex.map(self._save_struct, self.seq)):
+                if buf is None:
+                    continue
+                info = tarfile.TarInfo(stem+'_'+s+'.fits')
+                info.size = buf.getbuffer().nbytes
+                info.mtime = time.time()
+                arch.addfile(info, buf)
+        return 0
+
 
     def shift_from_rf(self, z=0):
         """ @brief Shift x axis to the original frame.
@@ -28,13 +28,15 @@ class Spectrum(Frame):
                  dy=[],
                  xunit=au.nm,
                  yunit=au.erg/au.cm**2/au.s/au.nm,
-                 meta={},
+                 meta=None,
                  dtype=float,
-                 cont=[]):
+                 cont=[],
+                 copy=True):
         super(Spectrum, self).__init__(x, xmin, xmax, y, dy, xunit, yunit, meta,
-                                       dtype)
+                                       dtype, copy)
         if cont != []:
-            self._t['cont'] = cont*self._yunit
+            self._t.add_column(self._column(cont, self._yunit, dtype, copy),
+                               name='cont', copy=False)
 
     def _copy(self, sel=None):
         copy = super(Spectrum, self)._copy(sel)
@@ -48,9 +50,7 @@ class Spectrum(Frame):
                         verb=True):
 
         # Create profile
-        xunit = self.x.unit
-        self._convert_x()
-        x = self._safe(self.x)
+        x = self._safe(self._view_x('x', zem=0, xunit=au.km/au.s))
         mean = np.median(x)
         prof = np.exp(-((x - mean) / std).value**2)
         if (len(prof) % 2 == 0):
@@ -68,11 +68,58 @@ class Spectrum(Frame):
         conv[self._where_safe] = fftconvolve(safe, prof, mode='same')\
                                               *self._t[input_col].unit
         self._t[output_col] = conv
-        self._convert_x(xunit=xunit)
 
         return 0
 
-    
+    def _convolve_gauss_prof(self, std=20):
+        """ @brief Create the gaussian profile of _convolve_gauss, for
+        _convolve_gauss_win.
+        @param std Standard deviation of the profile (km/s)
+        @return Non-vanishing part of the profile and its offset from the
+        center of the full profile
+        """
+
+        # Create profile as in _convolve_gauss, from all the pixels with a
+        # valid x (not only the ones where the column is valid)
+        v = self._view_x('x', zem=0, xunit=au.km/au.s).value
+        v = v[~np.isnan(v)]
+        prof = np.exp(-((v-np.median(v))/std)**2)
+        if (len(prof) % 2 == 0):
+            prof = prof[:-1]
+        prof = prof / np.sum(prof)
+        k = np.where(prof > 0)[0]
+        return prof[k[0]:k[-1]+1], (len(prof)-1)//2-k[0]
+
+    def _convolve_gauss_win(self, xmin, xmax, prof, safe, input_col='y'):
+        """ @brief Convolve a column with a gaussian profile as in
+        _convolve_gauss, only within a window of the spectrum and without
+        modifying the spectrum.
+        @param xmin Start of the window (nm)
+        @param xmax End of the window (nm)
+        @param prof Profile and offset, from _convolve_gauss_prof
+        @param safe Indices of the valid rows of the column
+        @param input_col Column to convolve
+        @return Indices of the window and convolved column within it
+        """
+
+        # As in _convolve_gauss, only the valid rows of the column are
+        # convolved; the window is found on the wavelengths of all rows
+        x = self._view_x('x', xunit=au.nm).value
+        i0 = max(np.searchsorted(safe, np.searchsorted(x, xmin, 'right'))-1,
+                 0)
+        i1 = min(np.searchsorted(safe, np.searchsorted(x, xmax))+1, len(safe))
+
+        # Only the non-vanishing part of the profile is used, with the same
+        # alignment and zero padding of the full convolution
+        p, h = prof
+        s0, s1 = i0+h-len(p)+1, i1+h
+        a = np.asarray(self._t[input_col])
+        seg = np.zeros(s1-s0)
+        seg[max(s0, 0)-s0:min(s1, len(safe))-s0] = \
+            a[safe[max(s0, 0):min(s1, len(safe))]]
+        conv = np.convolve(seg, p, mode='valid')
+
+        return safe[i0:i1], conv
 
     def _extract_nodes(self, delta_x=1500, xunit=au.km/au.s):
 
@@ -86,6 +133,8 @@ class Spectrum(Frame):
         if 'lines_mask' not in self._t.colnames:
             print(prefix, "Lines weren't masked. I'm taking all spectrum.")
 
+        x = self.x.value
+
         for s in self._slice_range:
             try:
                 where_s = np.where(np.logical_and(self._t['slice']==s,
@@ -95,7 +144,7 @@ class Spectrum(Frame):
 
             #print(self.x[np.where(self._t['slice']==s)][0], len(where_s[0]))
             if len(where_s[0])>0:
-                x_where_s = self.x[where_s].value
+                x_where_s = x[where_s]
                 y_where_s = self.y[where_s].value
                 dy_where_s = self.dy[where_s].value
                 x_ave.append(np.average(x_where_s))
@@ -103,9 +152,9 @@ class Spectrum(Frame):
                 xmax_ave.append(x_where_s[-1])
                 y_ave.append(np.average(y_where_s, weights=dy_where_s))
                 dy_ave.append(sem(y_where_s))
-        x = np.array(x_ave) * self._xunit
-        xmin = np.array(xmin_ave) * self._xunit
-        xmax = np.array(xmax_ave) * self._xunit
+        x = self._x_stored(np.array(x_ave) * self._xunit) * au.nm
+        xmin = self._x_stored(np.array(xmin_ave) * self._xunit) * au.nm
+        xmax = self._x_stored(np.array(xmax_ave) * self._xunit) * au.nm
         y = np.array(y_ave) * self._yunit
         dy = np.array(dy_ave) * self._yunit
 
@@ -212,12 +261,9 @@ class Spectrum(Frame):
         @return 0
         """
 
-        xunit_orig = self._xunit
-        self._convert_x(xunit=xunit)
-        x = self._safe(self.x)
+        x = self._safe(self._view_x('x', zem=0, xunit=xunit))
         self._t['slice'] = np.empty(len(self.x), dtype=int)
         self._t['slice'][self._where_safe] = np.array(x//delta_x)
         self._slice_range = range(self._t['slice'][self._where_safe][0],
                                   self._t['slice'][self._where_safe][-1])
-        self._convert_x(xunit=xunit_orig)
         return 0
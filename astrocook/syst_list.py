@@ -1,5 +1,6 @@
 from .vars import *
 from .functions import convolve, lines_voigt, psf_gauss, running_mean
+from .table_buffer import TableBuffer
 from astropy import table as at
 from astropy import units as au
 #from matplotlib import pyplot as plt
@@ -27,7 +28,7 @@ class SystList(object):
                  mod=[],
                  chi2r=[],
                  id=[],
-                 meta={},
+                 meta=None,
                  dtype=float):
 
         self._id = id_start
@@ -36,7 +37,7 @@ class SystList(object):
         zunit = au.dimensionless_unscaled
         logNunit = au.dimensionless_unscaled
         bunit = au.km/au.s
-        t['func'] = at.Column(np.array(func, ndmin=1), dtype='S5')
+        t['func'] = at.Column(np.array(func, ndmin=1), dtype='S10')
         t['series'] = at.Column(np.array(series, ndmin=1), dtype='S100')
         t['z0'] = at.Column(np.array(z, ndmin=1), dtype=dtype, unit=zunit)
         t['z'] = at.Column(np.array(z, ndmin=1), dtype=dtype, unit=zunit)
@@ -73,9 +74,32 @@ class SystList(object):
         self._mods_t['chi2r'] = np.empty(len(self.z), dtype=dtype)
         self._mods_t['id'] = np.empty(len(self.z), dtype=object)
 
-        self._meta = meta
+        # Envelope of the footprint of the models, to find the models that
+        # overlap a given range (see SystModel._make_fp)
+        self._mods_t['xmin'] = np.full(len(self.z), -np.inf)
+        self._mods_t['xmax'] = np.full(len(self.z), np.inf)
+
+        self._meta = {} if meta is None else meta
         self._dtype = dtype
 
+        # Buffers to append rows to the tables
+        self._t_buf = TableBuffer()
+        self._mods_t_buf = TableBuffer()
+
+        # Indices of the rows of the systems (by id) and of the models (by
+        # object), rebuilt when they are found out of date (see _id_rows and
+        # _mod_row)
+        self._id_row_d = {}
+        self._mod_row_d = {}
+
+        # Index of the envelopes of the models, sorted by xmin with the running
+        # maximum of xmax, rebuilt when the table of models is replaced or
+        # appended to (see _mods_env)
+        self._env_t = None
+
+        # Changes of the tables recorded during a trial (see _trial_start)
+        self._trial_d = None
+
     @property
     def t(self):
         return self._t
@@ -102,7 +126,7 @@ class SystList(object):
 
     @func.setter
     def func(self, val):
-        self._t['func'] = np.array(val, dtype='S5')
+        self._t['func'] = np.array(val, dtype='S10')
 
     @z.setter
     def z(self, val, dtype=float):
@@ -114,18 +138,19 @@ class SystList(object):
         """ @brief Add a system to a system list.
         """
 
-        self._t.add_row(['voigt_func', series, z, z, None, logN, None, b, None,
-                         None, self._id])
+        self._t_buf._add_row(self._t, ['voigt_func', series, z, z, None, logN,
+                                       None, b, None, None, self._id])
+        self._id_row_d.setdefault(self._id, len(self._t)-1)
 
         return 0
 
 
     def _append(self, frame, unique=True):
-        vstack_t = at.vstack([self._t, frame._t])
-        vstack_mods_t = at.vstack([self._mods_t, frame._mods_t])
         if unique:
-            self._t = at.unique(vstack_t, keys=['z0', 'z'])
-            self._mods_t = at.unique(vstack_mods_t, keys=['z0'])
+            self._t = self._t_buf._append(self._t, frame._t, keys=['z0', 'z'])
+            self._mods_t = self._mods_t_buf._append(self._mods_t, frame._mods_t,
+                                                    keys=['z0'])
+            self._env_t = None
         #print(self._mods_t['z0', 'id'])
         return 0
 
@@ -143,59 +168,415 @@ class SystList(object):
             self._mods_t.remove_rows(mods_rem)
         return 0
 
-    def _freeze(self):
-        """ Create a frozen copy of the tables self._t and self._mods_t
+    def _copy_tables(self, t, mods_t):
+        """ Copy the tables of systems and models. Models are not copied, as
+        fitting never modifies them: only their references are.
         """
-        t = dc(self._t)
-        mods_t = dc(self._mods_t)
+        t = t.copy()
+        mods_t_copy = mods_t.copy()
 
         # Needed, otherwise the id objects are not copied
-        for i, m in enumerate(mods_t):
-            m['id'] = dc(self._mods_t['id'][i])
+        for i, m in enumerate(mods_t_copy):
+            m['id'] = list(mods_t['id'][i])
 
-        return t, mods_t
+        return t, mods_t_copy
 
-    def _unfreeze(self, t, mods_t):
-        """ Restore from a frozen copy of the tables self._t and self._mods_t
+    def _freeze(self):
+        """ Create a frozen copy of the tables self._t and self._mods_t, and
+        of the id counter
         """
 
-        self._t = t
+        return self._copy_tables(self._t, self._mods_t) + (self._id,)
+
+    def _unfreeze(self, t, mods_t, id):
+        """ Restore from a frozen copy of the tables self._t and self._mods_t,
+        and of the id counter. The frozen copy is left untouched, so that it
+        can be restored again.
+        """
+
+        self._t, self._mods_t = self._copy_tables(t, mods_t)
+        self._id = id
+
+    def _row_vals(self, t, r):
+        """ @brief Values of a row of a table (lists are copied).
+        @param t Table
+        @param r Row
+        @return Values of the row, in the order of the columns
+        """
+
+        return [list(v) if isinstance(v, list) else v
+                for v in [t[c][r] for c in t.colnames]]
+
+    def _trial_start(self):
+        """ @brief Start recording the changes to the tables of systems and
+        models, to restore them later without copying the tables. A trial is
+        the addition of a model: systems and models are added at the end of the
+        tables, the rows of the group of the model are changed, and the rows of
+        the models merged into the group are removed (see _trial_rec and
+        _mods_merge).
+        """
+
+        self._trial_d = {'n_t': len(self._t), 'n_mods': len(self._mods_t),
+                         'id': self._id, 't': {}, 'mods': {}, 'rem': []}
+
+    def _trial_rec(self, key, rows):
+        """ @brief Record the values of rows before they are changed during a
+        trial (only the first time, and only for rows that existed when the
+        trial was started).
+        @param key 't' for systems, 'mods' for models
+        @param rows Rows
+        """
+
+        d = self._trial_d
+        if d is None:
+            return
+        t = self._t if key == 't' else self._mods_t
+        for r in rows:
+            if r not in d[key] and r < d['n_'+key]:
+                d[key][r] = self._row_vals(t, r)
+
+    def _trial_stop(self):
+        """ @brief Stop recording the changes of a trial.
+        @return States of the changed rows before and after the trial (see
+        _trial_set)
+        """
+
+        d = self._trial_d
+        self._trial_d = None
+        n_base = d['n_mods']-len(d['rem'])
+        before = dict(d, rem_in=True, t_tail=[], mods_tail=[])
+        after = dict(d, rem_in=False, id=self._id,
+                     t={r: self._row_vals(self._t, r) for r in d['t']},
+                     mods={r: self._row_vals(self._mods_t, r)
+                           for r in d['mods']},
+                     t_tail=[self._row_vals(self._t, r)
+                             for r in range(d['n_t'], len(self._t))],
+                     mods_tail=[self._row_vals(self._mods_t, r)
+                                for r in range(n_base, len(self._mods_t))])
+        return before, after
+
+    def _trial_set(self, state):
+        """ @brief Set the rows changed by a trial to one of their states.
+        @param state State of the rows, from _trial_stop
+        """
+
+        # Systems
+        self._t = self._t_buf._truncate(self._t, state['n_t'])
+        for v in state['t_tail']:
+            self._t_buf._add_row(self._t, v)
+        for r, v in state['t'].items():
+            for c, x in zip(self._t.colnames, v):
+                self._t[c][r] = x
+        self._t_buf._modified(['z'])
+
+        # Models (the merged models are either all in the table or all out)
+        mods_t = self._mods_t
+        rem = state['rem']
+        if len(rem) > 0:
+            pos = np.array([p for p, _ in rem])
+            rem_in = len(mods_t) == state['n_mods']
+            if rem_in and not state['rem_in']:
+                for m in mods_t['mod'][pos]:
+                    self._env_del(m)
+                mods_t.remove_rows(pos)
+            elif not rem_in and state['rem_in']:
+                mods_t = self._mods_t_buf._insert_rows(
+                    mods_t, pos-np.arange(len(pos)), [v for _, v in rem])
+        else:
+            n = state['n_mods']
+            for m in mods_t['mod'][n:]:
+                self._env_del(m)
+            mods_t = self._mods_t_buf._truncate(mods_t, n)
+            for v in state['mods_tail']:
+                self._mods_t_buf._add_row(mods_t, v)
+        for r, v in state['mods'].items():
+            self._env_del(mods_t['mod'][r])
+            for c, x in zip(mods_t.colnames, v):
+                mods_t[c][r] = x
         self._mods_t = mods_t
+        self._id = state['id']
+
+        # Models that were put back in the table are indexed again
+        rows = list(state['mods'])
+        if len(rem) > 0 and state['rem_in']:
+            rows += [p for p, _ in rem]
+        elif len(rem) == 0:
+            rows += range(state['n_mods'], len(mods_t))
+        for r in rows:
+            self._env_set(mods_t['mod'][r], r)
+
+
+    def _id_rows(self, ids):
+        """ @brief Find the rows of the systems with given ids.
+        The index is rebuilt only when an id is not found in the indexed row
+        (i.e. after rows are removed or sorted, or the table is replaced).
+        @param ids Ids of the systems
+        @return Rows of the systems (-1 for the ids that are not found)
+        """
 
+        # Lists of ids of merged models may contain arrays of ids, which are
+        # not found (as by a comparison with the column of ids)
+        ids = [i if np.ndim(i) == 0 else None for i in ids]
+        col = np.asarray(self._t['id'])
+        rows = [self._id_row_d.get(i, -1) for i in ids]
+        if any([i is not None and (r < 0 or r >= len(col) or col[r] != i)
+                for i, r in zip(ids, rows)]):
+            self._id_row_d = {}
+            for r, i in enumerate(col.tolist()):
+                self._id_row_d.setdefault(i, r)
+            rows = [self._id_row_d.get(i, -1) for i in ids]
+        return rows
+
+    def _mod_row(self, mod):
+        """ @brief Find the row of a model in the table of models.
+        The index is rebuilt only when the model is not found where expected.
+        @param mod Model
+        @return Row of the model
+        """
+
+        col = np.asarray(self._mods_t['mod'])
+        r = self._mod_row_d.get(id(mod), -1)
+        if r < 0 or r >= len(col) or col[r] is not mod:
+            self._mod_row_d = {id(m): r for r, m in enumerate(col)}
+            r = self._mod_row_d[id(mod)]
+        return r
+
+    def _mods_merge(self, mods_t, rows):
+        """ @brief Merge models into a group: the rows of the models after the
+        first one are removed, and their systems are added to the first row of
+        the table.
+        @param mods_t Table of models
+        @param rows Rows of the models
+        """
+
+        ids = list(np.ravel([np.array(i) for i in mods_t['id'][rows[1:]]]))
+        if mods_t is self._mods_t:
+            self._trial_rec('mods', [0])
+            if self._trial_d is not None:
+                self._trial_d['rem'] = [(r, self._row_vals(mods_t, r))
+                                        for r in rows[1:]]
+            for m in mods_t['mod'][rows[1:]]:
+                self._env_del(m)
+        mods_t.remove_rows(rows[1:])
+        for i in ids:
+            mods_t['id'][0].append(i)
+
+    def _env_build(self, mods_t):
+        """ @brief Build the index of the envelopes of the models.
+        @param mods_t Table of models
+        """
+
+        xmin = np.array(mods_t['xmin'], dtype=float)
+        order = np.argsort(xmin, kind='stable')
+        self._env_t = mods_t
+        self._env_x = xmin[order]
+        self._env_xmax = np.array(mods_t['xmax'], dtype=float)[order]
+        self._env_r = np.maximum.accumulate(self._env_xmax)
+        self._env_m = np.asarray(mods_t['mod'])[order]
+        self._env_x_d = {id(m): x for m, x in zip(self._env_m, self._env_x)}
+        self._env_row_d = {}
+
+    def _env_remove(self, sel):
+        """ @brief Remove entries from the index of the envelopes.
+        @param sel Positions of the entries in the index
+        """
+
+        for m in self._env_m[sel]:
+            self._env_x_d.pop(id(m), None)
+        self._env_x = np.delete(self._env_x, sel)
+        self._env_xmax = np.delete(self._env_xmax, sel)
+        self._env_m = np.delete(self._env_m, sel)
+
+    def _env_runmax(self, k):
+        """ @brief Update the running maximum of xmax from a position onwards.
+        @param k Position in the index
+        """
+
+        r = np.maximum.accumulate(self._env_xmax[k:])
+        if k > 0 and len(r) > 0:
+            np.maximum(r, self._env_r[k-1], out=r)
+        self._env_r = np.append(self._env_r[:k], r)
+
+    def _env_del(self, mod):
+        """ @brief Remove a model from the index of the envelopes.
+        @param mod Model
+        @return Position of the model in the index (the length of the index if
+        the model is not found; None if the index is out of date)
+        """
+
+        if self._env_t is not self._mods_t:
+            return None
+        if id(mod) not in self._env_x_d:
+            return len(self._env_x)
+        i = np.searchsorted(self._env_x, self._env_x_d[id(mod)])
+        while self._env_m[i] is not mod:
+            i += 1
+        self._env_remove([i])
+        self._env_runmax(i)
+        return i
+
+    def _env_set(self, mod, row):
+        """ @brief Update the index of the envelopes after the envelope of a
+        model was written into the table of models.
+        @param mod Model
+        @param row Row of the model
+        """
+
+        k = self._env_del(mod)
+        if k is None:
+            return
+        xmin = float(self._mods_t['xmin'][row])
+        xmax = float(self._mods_t['xmax'][row])
+        i = np.searchsorted(self._env_x, xmin, side='right')
+        self._env_x = np.insert(self._env_x, i, xmin)
+        self._env_xmax = np.insert(self._env_xmax, i, xmax)
+        m = np.empty(1, dtype=object)
+        m[0] = mod
+        self._env_m = np.insert(self._env_m, i, m)
+        self._env_x_d[id(mod)] = xmin
+        self._env_row_d[id(mod)] = row
+        self._env_runmax(min(i, k))
+
+    def _mods_env(self, mods_t, xmin, xmax):
+        """ @brief Find the models whose envelope overlaps a range. Only the
+        entries of the index with xmin below the end of the range and with a
+        running maximum of xmax above its start are checked.
+        @param mods_t Table of models
+        @param xmin Start of the range
+        @param xmax End of the range
+        @return Sorted rows of the models
+        """
+
+        if self._env_t is not mods_t:
+            self._env_build(mods_t)
+        i1 = np.searchsorted(self._env_x, xmax, side='right')
+        i0 = np.searchsorted(self._env_r[:i1], xmin, side='left')
+        c = i0+np.where(self._env_xmax[i0:i1] >= xmin)[0]
+
+        # Models removed from the table since they were indexed are dropped
+        col = np.asarray(mods_t['mod'])
+        rows, stale = [], []
+        for j in c:
+            m = self._env_m[j]
+            r = self._env_row_d.get(id(m), -1)
+            if r < 0 or r >= len(col) or col[r] is not m:
+                self._env_row_d = {id(m): r for r, m in enumerate(col)}
+                r = self._env_row_d.get(id(m), -1)
+            if r < 0:
+                stale.append(j)
+            else:
+                rows.append(r)
+        if len(stale) > 0:
+            self._env_remove(stale)
+            self._env_runmax(stale[0])
+        return np.sort(np.array(rows, dtype=int))
+
+    def _transmission(self):
+        """ @brief Transmission of the models over the spectrum (self._xs).
+        The transmission is kept between calls: only the pixels in the
+        footprints of the models that were added, changed or removed since the
+        last call are recomputed.
+        @return Transmission
+        """
+
+        xs = self._xs
+        if not hasattr(self, '_trans') or len(self._trans) != len(xs) \
+            or not np.array_equal(self._trans_xs, xs):
+            self._trans = np.ones(len(xs))
+            self._trans_xs = xs
+            self._trans_d = {}
+        trans = self._trans
+        old = self._trans_d
+        new = {id(m): (m, getattr(m, '_fp_t', None))
+               for m in self._mods_t['mod']}
+        changed = [k for k in old if k not in new or new[k][1] is not old[k][1]]
+        changed += [k for k in new if k not in old]
+        if len(changed) == 0:
+            return trans
+
+        # Footprints computed on a different spectrum (or missing) are replaced
+        # by the full evaluation of the model
+        dirty = np.zeros(len(xs), dtype=bool)
+        for k in changed:
+            if k in old:
+                dirty[old[k][1][0]] = True
+            if k in new:
+                m, fp_t = new[k]
+                if fp_t is None or (len(fp_t[0]) > 0 and (
+                    fp_t[0][-1] >= len(xs)
+                    or not np.array_equal(xs[fp_t[0]], fp_t[2]))):
+                    ys = m.eval(x=xs, params=m._pars)
+                    c = np.where(ys < 1)[0]
+                    m._fp_t = (c, ys[c], xs[c])
+                    new[k] = (m, m._fp_t)
+                dirty[new[k][1][0]] = True
+
+        # Dirty pixels are recomputed from all the models covering them
+        trans[dirty] = 1
+        for m, fp_t in new.values():
+            w = dirty[fp_t[0]]
+            if np.any(w):
+                trans[fp_t[0][w]] *= fp_t[1][w]
+        self._trans_d = new
+        return trans
 
     def _update(self, mod, mod_t=True):
 
         #print(mod._id, mod._group_sel)
         if mod_t:
             if mod._group_sel == -1:
-                self._mods_t.add_row([mod._z0, mod, None, []])
+                self._mods_t_buf._add_row(self._mods_t, [mod._z0, mod, None, [],
+                                                         -np.inf, np.inf])
+                self._mod_row_d[id(mod)] = len(self._mods_t)-1
             else:
+                self._trial_rec('mods', [mod._group_sel])
+                self._env_del(self._mods_t['mod'][mod._group_sel])
                 self._mods_t[mod._group_sel]['mod'] = mod
+                self._mod_row_d[id(mod)] = mod._group_sel
             try:
                 self._mods_t[mod._group_sel]['chi2r'] = mod._chi2r
             except:
                 self._mods_t[mod._group_sel]['chi2r'] = np.nan
             self._mods_t[mod._group_sel]['id'].append(mod._id)
 
-        modw = np.where(mod == self._mods_t['mod'])[0][0]
+        modw = self._mod_row(mod)
         ids = self._mods_t['id'][modw]
+        try:
+            lo, hi = mod._make_fp()
+            self._mods_t['xmin'][modw] = lo[0] if len(lo) > 0 else np.inf
+            self._mods_t['xmax'][modw] = hi[-1] if len(hi) > 0 else -np.inf
+        except:
+            pass
+        self._env_set(mod, modw)
         #print(ids)
-        for i in ids:
+
+        # Fitted parameters are collected and written column by column
+        rows = []
+        vals = []
+        for i, iw in zip(ids, self._id_rows(ids)):
+            if iw < 0:
+                continue
+            pref = 'lines_voigt_'+str(i)
             try:
-                iw = np.where(self._t['id']==i)[0][0]
-                pref = 'lines_voigt_'+str(i)
-                self._t[iw]['z'] = mod._pars[pref+'_z'].value
-                self._t[iw]['dz'] = mod._pars[pref+'_z'].stderr
-                self._t[iw]['logN'] = mod._pars[pref+'_logN'].value
-                self._t[iw]['dlogN'] = mod._pars[pref+'_logN'].stderr
-                self._t[iw]['b'] = mod._pars[pref+'_b'].value
-                self._t[iw]['db'] = mod._pars[pref+'_b'].stderr
-                try:
-                    self._t[iw]['chi2r'] = mod._chi2r
-                except:
-                    self._t[iw]['chi2r'] = np.nan
+                vals.append([mod._pars[pref+'_z'].value,
+                             mod._pars[pref+'_z'].stderr,
+                             mod._pars[pref+'_logN'].value,
+                             mod._pars[pref+'_logN'].stderr,
+                             mod._pars[pref+'_b'].value,
+                             mod._pars[pref+'_b'].stderr])
+                rows.append(iw)
             except:
                 pass
+        if len(rows) > 0:
+            self._trial_rec('t', rows)
+            vals = np.array(vals, dtype=float)
+            for j, c in enumerate(['z', 'dz', 'logN', 'dlogN', 'b', 'db']):
+                self._t[c][rows] = vals[:, j]
+            self._t_buf._modified(['z'])
+            try:
+                self._t['chi2r'][rows] = mod._chi2r
+            except:
+                self._t['chi2r'][rows] = np.nan
         self._id += 1
 
         #print(self._mods_t['id', 'chi2r'])
@@ -1,24 +1,54 @@
-from .functions import adj_gauss, lines_voigt, convolve, psf_gauss
+from .functions import adj_gauss, lines_voigt, convolve, convolve_jac, \
+    psf_gauss, _lines_voigt_dtau
 from .vars import *
 from astropy import table as at
-import datetime
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy as dc
 from lmfit import CompositeModel as LMComposite
 from lmfit import Model as LMModel
 from lmfit import Parameters as LMParameters
 from matplotlib import pyplot as plt
 import numpy as np
+import threading
 
 prefix = "System model:"
 
 thres = 1e-5
+trans_thres = 1e-8
+
+def _fp_runs(x, c):
+    """ @brief Convert a set of pixels into the ranges of a footprint.
+    @param x Wavelengths
+    @param c Sorted indices of the pixels
+    @return Start and end wavelengths of the contiguous ranges of pixels
+    """
+
+    if len(c) == 0:
+        return x[:0], x[:0]
+    s = np.where(np.ediff1d(c) > 1)[0]
+    return x[c[np.append(0, s+1)]], x[c[np.append(s, len(c)-1)]]
+
+def _fp_overlap(fp_1, fp_2):
+    """ @brief Check if two footprints share at least one pixel.
+    @param fp_1 First footprint
+    @param fp_2 Second footprint
+    @return True if the footprints overlap
+    """
+
+    return np.any(np.logical_and(fp_1[0][:, None] <= fp_2[1][None, :],
+                                 fp_2[0][None, :] <= fp_1[1][:, None]))
 
 class SystModel(LMComposite):
 
     def __init__(self, spec, systs, series=[], vars=[], z0=None,
                  lines_func=lines_voigt,
                  psf_func=psf_gauss,
-                 cont_func=None):
+                 cont_func=None,
+                 fadd='wofz',
+                 window=False):
         self._spec = spec
+        self._systs = systs
         try:
             self._mods_t = systs._mods_t
         except:
@@ -29,30 +59,128 @@ class SystModel(LMComposite):
         self._z0 = z0
         self._lines_func = lines_func
         self._psf_func = psf_func
+        self._fadd = fadd
+        self._window = window
 
 
-    def _fit(self, fit_kws={}):
-        time_start = datetime.datetime.now()
+    def _fit(self, fit_kws={}, jac=True):
+        """ @brief Fit the model to the spectrum.
+        @param fit_kws Keywords for the optimizer
+        @param jac Use the analytic Jacobian, when available
+        """
+
+        if jac and self._jac_check():
+            fit_kws = dict(fit_kws, jac=self._jac)
         fit = super(SystModel, self).fit(self._yf, self._pars, x=self._xf,
                                          weights=self._wf, fit_kws=fit_kws,
                                          method='least_squares')
-                                         #method='emcee')
-        time_end = datetime.datetime.now()
-        #print(fit.nfev, time_end-time_start)
+        self._nfev = fit.nfev
         self._pars = fit.params
         self._chi2r = fit.redchi
         self._aic = fit.aic
         self._bic = fit.bic
 
+    def _fit_multi(self, starts, fit_kws={}, jac=True, n_thread=1):
+        """ @brief Fit the model to the spectrum from several start points,
+        reusing its structure (lmfit fits a copy of the parameters). The model
+        is left unchanged.
+        @param starts Start points, as dictionaries of parameter values (the
+        other parameters keep the values of the model)
+        @param fit_kws Keywords for the optimizer
+        @param jac Use the analytic Jacobian, when available
+        @param n_thread Number of threads
+        @return Results of the fits, as dictionaries with the parameters, the
+        reduced chi2, the AIC, the BIC and the number of function evaluations
+        """
+
+        # The model is not thread-safe (e.g. _jac reads its parameters), so
+        # each thread fits its own copy
+        local = threading.local()
+
+        def fit_start(start):
+            if n_thread > 1:
+                if not hasattr(local, 'mod'):
+                    local.mod = dc(self)
+                m = local.mod
+            else:
+                m = self
+            pars = dc(m._pars)
+            for n, v in start.items():
+                pars[n].set(value=v)
+
+            # The analytic Jacobian reads the fixed parameters from the model,
+            # so the start point must only move the varying ones
+            kws = dict(fit_kws)
+            if jac and m._jac_check() \
+                and all([n in m._jac_names for n in start]):
+                kws['jac'] = m._jac
+            fit = super(SystModel, m).fit(m._yf, pars, x=m._xf,
+                                          weights=m._wf, fit_kws=kws,
+                                          method='least_squares')
+            return {'pars': fit.params, 'chi2r': fit.redchi, 'aic': fit.aic,
+                    'bic': fit.bic, 'nfev': fit.nfev}
+
+        if n_thread > 1 and len(starts) > 1:
+            with ThreadPoolExecutor(n_thread) as ex:
+                return list(ex.map(fit_start, starts))
+        return [fit_start(s) for s in starts]
+
+    def _jac(self, p, **kwargs):
+        """ @brief Analytic Jacobian of the weighted residuals, with respect to
+        the varying parameters (in the order used by the optimizer).
+        @param p Values of the varying parameters
+        @return Jacobian matrix (one column per parameter)
+        """
+
+        vals = {n: self._pars[n].value for n in self._pars}
+        vals.update(zip(self._jac_names, p))
+        x = self._xf
+        tau = np.zeros(len(x))
+        dtau = np.zeros((len(p), len(x)))
+        for c in self._group.components:
+            pref = c.prefix
+            t, dt = _lines_voigt_dtau(x, vals[pref+'z'], vals[pref+'logN'],
+                                      vals[pref+'b'], vals[pref+'btur'],
+                                      c.opts['series'])
+            tau += t
+            for i, v in enumerate(['z', 'logN', 'b', 'btur']):
+                if pref+v in self._jac_names:
+                    dtau[self._jac_names.index(pref+v)] = dt[i]
+        group = np.exp(-tau)
+        psf = self._psf.eval(x=x, params=self._pars)
+        _, jac = convolve_jac(group, -group*dtau, psf)
+        return (jac * self._wf).T
+
+    def _jac_check(self):
+        """ @brief Check that the analytic Jacobian applies to the model: all
+        lines are Voigt profiles and all varying parameters are unconstrained
+        parameters of the lines.
+        @return True if the analytic Jacobian applies
+        """
+
+        if self._lines_func != lines_voigt:
+            return False
+        if any([c.func != lines_voigt for c in self._group.components]):
+            return False
+        if any([p.expr is not None for p in self._pars.values()]):
+            return False
+        self._jac_names = [n for n, p in self._pars.items() if p.vary]
+        pars = [c.prefix+v for c in self._group.components
+                for v in ['z', 'logN', 'b', 'btur']]
+        return all([n in pars for n in self._jac_names])
+
     def _make_comp(self):
         super(SystModel, self).__init__(self._group, self._psf, convolve)
 
 
     def _make_defs(self):
-        self._defs = pars_std_d
-        for v in self._vars:
-            if v in self._defs:
-                self._defs[v] = self._vars[v]
+        """ @brief Set the defaults of the parameters of the model. The values
+        in self._vars override the standard defaults, which are shared by all
+        models and never modified.
+        """
+
+        self._defs = ChainMap({v: self._vars[v] for v in self._vars
+                               if v in pars_std_d}, pars_std_d)
 
     def _make_group(self, thres=thres):
         """ @brief Group lines that must be fitted together into a single model.
@@ -61,24 +189,33 @@ class SystModel(LMComposite):
         spec = self._spec
 
         mods_t = self._mods_t
-        self._xs = np.array(spec._safe(spec.x).to(au.nm))
+        self._xs = spec._safe(spec.x).to_value(au.nm)
         ys = self._lines.eval(x=self._xs, params=self._pars)
         self._group = self._lines
         self._group_list = []
-        for i, s in enumerate(mods_t):
-            mod = s['mod']
-            ys_s = mod.eval(x=self._xs, params=mod._pars)
-            #ys_s = mod._ys
-            if np.amin(np.maximum(ys, ys_s)) < 1-thres:
+
+        # Models overlapping the lines are found with a range query on the
+        # envelopes of the footprints of the models, sorted by start (see
+        # SystList._mods_env), instead of evaluating all of them
+        c = np.where(ys < 1-thres)[0]
+        if len(c) > 0:
+            fp = _fp_runs(self._xs, c)
+            sel = self._systs._mods_env(mods_t, fp[0][0], fp[1][-1])
+        else:
+            sel = []
+        for i in sel:
+            mod = mods_t['mod'][i]
+            try:
+                overlap = _fp_overlap(fp, mod._fp)
+            except:
+                ys_s = mod.eval(x=self._xs, params=mod._pars)
+                overlap = np.amin(np.maximum(ys, ys_s)) < 1-thres
+            if overlap:
                 self._group *= mod._group
                 self._pars.update(mod._pars)
                 self._group_list.append(i)
         if len(self._group_list) > 1:
-            ids = list(np.ravel([np.array(i)
-                                 for i in mods_t['id'][self._group_list[1:]]]))
-            mods_t.remove_rows(self._group_list[1:])
-            for i in ids:
-                mods_t['id'][0].append(i)
+            self._systs._mods_merge(mods_t, self._group_list)
         if self._group_list == []:
             self._group_sel = -1
         else:
@@ -87,12 +224,30 @@ class SystModel(LMComposite):
         #plt.plot(self._xs, self._ys)
         #plt.show()
 
+    def _make_fp(self, thres=thres, trans_thres=trans_thres):
+        """ @brief Find the footprint of the model, i.e. the ranges where it
+        absorbs more than a threshold.
+        @param thres Threshold
+        @param trans_thres Threshold to store the transmission of the model
+        @return Start and end wavelengths of the ranges (nm)
+        """
+
+        ys = self.eval(x=self._xs, params=self._pars)
+        self._fp = _fp_runs(self._xs, np.where(ys < 1-thres)[0])
+
+        # Transmission over a wider footprint (including the wings of the
+        # lines), to update the model spectrum
+        c = np.where(ys < 1-trans_thres)[0]
+        self._fp_t = (c, ys[c], self._xs[c])
+        return self._fp
+
     def _make_lines(self):
         self._lines_pref = self._lines_func.__name__+'_'+str(self._id)+'_'
         line = LMModel(self._lines_func, prefix=self._lines_pref,
-                       series=self._series)
+                       series=self._series, fadd=self._fadd,
+                       window=self._window)
         d = self._defs
-        self._pars = line.make_params()
+        self._pars = LMParameters()
         self._pars.add_many(
             #(self._lines_pref+'z', d['z'], d['z_vary'], d['z_min'], d['z_max'],
             # d['z_expr']),
@@ -116,7 +271,6 @@ class SystModel(LMComposite):
                 self._psf = psf
             else:
                 self._psf += psf
-            self._pars.update(psf.make_params())
             self._pars.add_many(
                 (self._psf_pref+'resol', d['resol'], d['resol_vary'],
                  d['resol_min'], d['resol_max'], d['resol_expr']))
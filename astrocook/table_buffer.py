@@ -0,0 +1,282 @@
+from astropy import table as at
+import numpy as np
+
+class TableBuffer(object):
+    """ Class for table buffers
+
+    A TableBuffer keeps the columns of an astropy Table in preallocated arrays,
+    whose capacity is doubled when they are full, so that rows are appended in
+    amortized constant time. The columns of the table are views of the arrays,
+    rebound in place after each append (the Table object is preserved).
+
+    After an append with unique keys, the rows are sorted by keys; the buffer
+    remembers how many rows are sorted, so that later appends only sort the new
+    rows and merge them into the sorted ones.
+
+    The table is always the reference: the buffer adopts it again (without
+    copying it) whenever it was replaced or its columns were changed by other
+    operations (e.g. add_row, remove_rows, or by setting a column). """
+
+    def __init__(self):
+        self._t = None
+        self._cols = []
+        self._data = {}
+        self._n = 0
+        self._keys = None
+        self._n_sorted = 0
+
+    def __deepcopy__(self, memo):
+        # Buffers are rebuilt from the tables on demand
+        return TableBuffer()
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def _adopt(self, t):
+        """ @brief Adopt a table, if it is not the one of the buffer or if its
+        columns were changed. The columns of the table are used as arrays,
+        without spare capacity.
+        @param t Table
+        @return True if the rows of the table can be appended through the
+        buffer (no masked columns)
+        """
+
+        cols = list(t.columns.values())
+        if t is not self._t or len(cols) != len(self._cols) \
+            or any([c is not s for c, s in zip(cols, self._cols)]):
+            self._t = t
+            self._cols = cols
+            self._data = {n: np.asarray(c) for n, c in t.columns.items()}
+            self._n = len(t)
+            self._n_sorted = 0
+        return not t.masked \
+            and not any([isinstance(c, at.MaskedColumn) for c in cols])
+
+    def _fits(self, d, v):
+        """ @brief Check whether a value can be written into an array without
+        being truncated (strings must not be longer than the items).
+        @param d Array
+        @param v Value
+        @return True if the value fits
+        """
+
+        kind = d.dtype.kind
+        if kind not in 'SU' or not isinstance(v, (str, bytes)):
+            return True
+        if kind == 'S' and isinstance(v, str):
+            v = v.encode('utf-8')
+        return len(v) <= d.dtype.itemsize // np.dtype(kind+'1').itemsize
+
+    def _compat(self, d, d_app):
+        """ @brief Check whether the items of an array can be written into
+        another one (same dtype, or strings not longer than the items).
+        @param d Array
+        @param d_app Array to write
+        @return True if the arrays are compatible
+        """
+
+        if d.dtype == d_app.dtype:
+            return True
+        return d.dtype.kind in 'SU' and d_app.dtype.kind == d.dtype.kind \
+            and d_app.dtype.itemsize <= d.dtype.itemsize
+
+    def _grow(self, m):
+        """ @brief Make room for new rows, doubling the capacity if needed.
+        @param m Number of new rows
+        """
+
+        n = self._n
+        for k, d in self._data.items():
+            if len(d) < n+m:
+                new = np.empty((max(2*len(d), n+m, 16),)+d.shape[1:],
+                               dtype=d.dtype)
+                new[:n] = d[:n]
+                self._data[k] = new
+
+    def _rebind(self):
+        """ @brief Bind the columns of the table to the current rows of the
+        arrays.
+        """
+
+        cols = at.TableColumns([c.copy(data=self._data[k][:self._n],
+                                       copy_data=False)
+                                for k, c in self._t.columns.items()])
+        self._t._replace_cols(cols)
+        self._cols = list(self._t.columns.values())
+
+    def _add_row(self, t, vals):
+        """ @brief Add a row to a table (as Table.add_row).
+        @param t Table
+        @param vals Values of the row, in the order of the columns
+        @return 0
+        """
+
+        # Strings longer than their columns are added by Table.add_row, which
+        # widens the columns instead of truncating the strings
+        if not self._adopt(t) \
+            or not all([self._fits(d, v)
+                        for d, v in zip(self._data.values(), vals)]):
+            t.add_row(vals)
+            return 0
+        self._grow(1)
+        for d, v in zip(self._data.values(), vals):
+            d[self._n] = v
+        self._n += 1
+        self._rebind()
+        return 0
+
+    def _modified(self, cols):
+        """ @brief Signal that columns of the table were changed in place (the
+        rows are sorted again at the next append, if the columns are keys).
+        @param cols Names of the columns
+        """
+
+        if self._keys is not None and any([c in self._keys for c in cols]):
+            self._n_sorted = 0
+
+    def _unique(self, k_data):
+        """ @brief Find the first occurrence of each key, in the order of the
+        keys (as a stable sort).
+        @param k_data Arrays of the key columns
+        @return Indices of the rows
+        """
+
+        n = len(k_data[0])
+        order = np.lexsort(k_data[::-1])
+        first = np.ones(n, dtype=bool)
+        if n > 1:
+            k_sort = [d[order] for d in k_data]
+            first[1:] = np.any([d[1:] != d[:-1] for d in k_sort], axis=0)
+        return order[first]
+
+    def _locate(self, k_data, k_new):
+        """ @brief Find where new keys go in sorted unique keys.
+        @param k_data Arrays of the sorted key columns
+        @param k_new Arrays of the new key columns
+        @return Insertion indices, and flags for the keys already present
+        """
+
+        lo = np.searchsorted(k_data[0], k_new[0], side='left')
+        hi = np.searchsorted(k_data[0], k_new[0], side='right')
+        dup = hi > lo
+        # Ties on the first key are solved on the following ones
+        for j in np.where(dup)[0] if len(k_data) > 1 else []:
+            l, h = lo[j], hi[j]
+            for d, v in zip(k_data[1:], k_new[1:]):
+                l, h = l+np.searchsorted(d[l:h], v[j], side='left'), \
+                       l+np.searchsorted(d[l:h], v[j], side='right')
+                if h == l:
+                    break
+            lo[j], dup[j] = l, h > l
+        return lo, dup
+
+    def _append(self, t, t_app, keys):
+        """ @brief Append the rows of a table to another one, keeping only the
+        rows with unique keys, sorted by keys (as astropy.table.unique applied
+        to astropy.table.vstack).
+        @param t Table
+        @param t_app Table to append
+        @param keys Names of the key columns
+        @return Table with the rows appended
+        """
+
+        if not self._adopt(t) or t_app.masked \
+            or t.colnames != t_app.colnames \
+            or not all([self._compat(self._data[k], np.asarray(t_app[k]))
+                        for k in t.colnames]):
+            return at.unique(at.vstack([t, t_app]), keys=keys)
+        if keys != self._keys:
+            self._keys = keys
+            self._n_sorted = 0
+
+        # Rows after the sorted ones (added by _add_row) are merged together
+        # with the new ones, after them in the order of the table
+        s = self._n_sorted
+        n = self._n
+        m = len(t_app)
+        if n-s+m == 0:
+            return t
+        self._grow(m)
+        for k, d in self._data.items():
+            d[n:n+m] = t_app[k]
+        new = self._unique([self._data[k][s:n+m] for k in keys])+s
+        pos, dup = self._locate([self._data[k][:s] for k in keys],
+                                [self._data[k][new] for k in keys])
+        new, pos = new[~dup], pos[~dup]
+
+        self._merge(new, pos, s)
+        self._n_sorted = self._n
+        self._rebind()
+        return t
+
+    def _merge(self, new, pos, s):
+        """ @brief Move rows of the arrays into the first ones, keeping the
+        order of both.
+        @param new Rows to move (after s)
+        @param pos Sorted positions where the rows are inserted, among the
+        first s rows
+        @param s Number of rows where the rows are inserted
+        """
+
+        # Rows after the first insertion point are shifted to make room for
+        # the new ones; the rows before it are not moved
+        p0 = pos[0] if len(pos) > 0 else s
+        old = np.arange(p0, s)
+        old_to = old+np.searchsorted(pos, old, side='right')
+        new_to = pos+np.arange(len(pos))
+        for d in self._data.values():
+            d_new = d[new]
+            d[old_to] = d[p0:s].copy()
+            d[new_to] = d_new
+        self._n = s+len(new)
+
+    def _insert_rows(self, t, pos, vals):
+        """ @brief Insert rows into a table.
+        @param t Table
+        @param pos Sorted positions where the rows are inserted, in the table
+        before the insertion (as numpy.insert)
+        @param vals Values of the rows, in the order of the columns
+        @return Table with the rows inserted
+        """
+
+        if not self._adopt(t) \
+            or not all([self._fits(d, v) for r in vals
+                        for d, v in zip(self._data.values(), r)]):
+            for j, (p, r) in enumerate(zip(pos, vals)):
+                t.insert_row(p+j, r)
+            return t
+        n = self._n
+        m = len(vals)
+        self._grow(m)
+        for j, r in enumerate(vals):
+            for d, v in zip(self._data.values(), r):
+                d[n+j] = v
+        self._merge(np.arange(n, n+m), np.asarray(pos, dtype=int), n)
+        self._n_sorted = min(self._n_sorted, pos[0] if m > 0 else n)
+        self._rebind()
+        return t
+
+    def _truncate(self, t, n):
+        """ @brief Remove the rows of a table after a given one.
+        @param t Table
+        @param n Number of rows to keep
+        @return Table with the rows removed
+        """
+
+        if not self._adopt(t):
+            t.remove_rows(slice(n, None))
+            return t
+        if n >= self._n:
+            return t
+
+        # Removed objects are released
+        for d in self._data.values():
+            if d.dtype.kind == 'O':
+                d[n:self._n] = None
+        self._n = n
+        self._n_sorted = min(self._n_sorted, n)
+        self._rebind()
+        return t
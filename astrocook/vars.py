@@ -1,5 +1,6 @@
 from astropy import units as au
  #c, e, m_e
+import numpy as np
 
 xunit_def = au.nm
 yunit_def = au.erg / (au.Angstrom * au.cm**2 * au.s)
@@ -172,3 +173,17 @@ gamma_d = {'Ly_a': 6.265e+08,
               'CaII_3969': 1.409e+08,
               'neb': 5e8,
               'unknown': 6.265e+08}
+
+# Atomic data table, in canonical units (xem in nm, gamma in s^-1). Rows are
+# ordered by first appearance in series_d, so that the transitions of every
+# series are contiguous; transitions outside any series are appended.
+trans_l = list(dict.fromkeys([t for s in series_d.values() for t in s]
+                             + list(xem_d) + list(fosc_d) + list(gamma_d)))
+trans_i_d = {t: i for i, t in enumerate(trans_l)}
+series_i_d = {s: np.array([trans_i_d[t] for t in series_d[s]])
+              for s in series_d}
+atom_t = np.array([(t, xem_d[t].to(au.nm).value if t in xem_d else np.nan,
+                    fosc_d.get(t, np.nan), gamma_d.get(t, np.nan))
+                   for t in trans_l],
+                  dtype=[('trans', 'U16'), ('xem', float), ('fosc', float),
+                         ('gamma', float)])
@@ -0,0 +1,66 @@
+""" Cost and accuracy of the conversions of the x axis.
+
+A spectrum with a logarithmic wavelength grid is created (as in
+bench_suite.flat_spectrum); the x axis is then
+converted to velocities and back (Session.convert_x), and shifted to the rest
+frame and back (Session.shift_to_rf and shift_from_rf), reading the x, xmin
+and xmax columns after each step as a plot would. The time of the first round
+trip and the mean time of the following ones are reported, together with the
+time of Session.convolve_gauss (which works on velocities) and the largest
+change of the wavelengths after all round trips.
+
+Run from the repository root: python benchmarks/bench_convert.py [n_pix]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import flat_spectrum
+from astrocook import Session
+import contextlib
+import io
+import numpy as np
+import time
+
+n_pix = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+n_round = 10
+
+def read(sess):
+    for s in sess.seq:
+        frame = getattr(sess, s)
+        if frame is not None:
+            frame.x, frame.xmin, frame.xmax
+
+def run(name, func, *args):
+    wall = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(n_round):
+            start = time.perf_counter()
+            func(*args)
+            wall.append(time.perf_counter()-start)
+    print("%-22s %10.2f %10.2f" % (name, wall[0]*1e3, np.mean(wall[1:])*1e3))
+
+def round_velocity(sess):
+    sess.convert_x(zem=2.5, xunit='km/s')
+    read(sess)
+    sess.convert_x(zem=2.5, xunit='nm')
+    read(sess)
+
+def round_rest_frame(sess):
+    sess.shift_to_rf(z=2.5)
+    read(sess)
+    sess.shift_from_rf(z=0)
+    read(sess)
+
+sess = Session(name='bench', spec=flat_spectrum(n_pix))
+x0 = np.array(sess.spec.x)
+
+print("Spectrum of %i pixels" % n_pix)
+print("%-22s %10s %10s" % ('step', 'first_ms', 'next_ms'))
+run('convert_x (round)', round_velocity, sess)
+run('shift_to_rf (round)', round_rest_frame, sess)
+run('convolve_gauss', sess.convolve_gauss, 5)
+print("Largest change of x after the round trips: %.3e nm"
+      % np.max(np.abs(np.array(sess.spec.x)-x0)))
@@ -0,0 +1,53 @@
+""" Speed and accuracy of the Faddeeva evaluators used by lines_voigt.
+
+For each transition, the damping parameter a is computed over a realistic
+range of Doppler parameters, and Re(F(a, u)) is evaluated over a dense grid of
+u covering the Doppler core and the far wings. The 'dawsn' evaluator is
+compared with the reference 'wofz' one.
+
+Run from the repository root: python benchmarks/bench_fadd.py
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from astrocook.functions import _fadd, fadd_tol
+from astrocook.vars import *
+import numpy as np
+import time
+
+trans_b = {'Ly_a': np.arange(5.0, 50.0, 5.0),
+           'Ly_b': np.arange(5.0, 50.0, 5.0),
+           'CIV_1548': np.arange(2.0, 30.0, 4.0),
+           'SiIV_1393': np.arange(2.0, 30.0, 4.0),
+           'MgII_2796': np.arange(2.0, 30.0, 4.0),
+           'FeII_2382': np.arange(2.0, 30.0, 4.0)}
+u = np.linspace(-100, 100, 200001)
+n_rep = 5
+
+print("%-10s %8s %8s %10s %10s %10s %10s %8s"
+      % ('trans', 'b_min', 'b_max', 'a_max', 'max_abs', 'max_rel', 't_wofz',
+         'speedup'))
+for t, b_range in trans_b.items():
+    xem = atom_t['xem'][trans_i_d[t]]
+    gamma = atom_t['gamma'][trans_i_d[t]]
+    a_range = 0.25 * gamma * xem * 1e-12 / (np.pi * b_range)
+    max_abs = 0
+    max_rel = 0
+    t_wofz = 0
+    t_dawsn = 0
+    for a in a_range:
+        start = time.time()
+        for i in range(n_rep):
+            ref = _fadd(a, u, 'wofz')
+        t_wofz += time.time()-start
+        start = time.time()
+        for i in range(n_rep):
+            fast = _fadd(a, u, 'dawsn', fadd_tol)
+        t_dawsn += time.time()-start
+        max_abs = max(max_abs, np.max(np.abs(fast-ref)))
+        max_rel = max(max_rel, np.max(np.abs(fast-ref)/ref))
+    print("%-10s %8.1f %8.1f %10.2e %10.2e %10.2e %10.3f %8.2f"
+          % (t, b_range[0], b_range[-1], np.max(a_range), max_abs, max_rel,
+             t_wofz, t_wofz/t_dawsn))
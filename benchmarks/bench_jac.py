@@ -0,0 +1,64 @@
+""" Number of function evaluations and wall-clock time of SystModel._fit, with
+the analytic Jacobian and with finite-difference derivatives.
+
+A mock Lyman-alpha forest is created as in bench_suite.py; the models are then
+fitted from perturbed starting values with both methods.
+
+Run from the repository root: python benchmarks/bench_jac.py [n_pix]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import mock, mock_systs
+from copy import deepcopy as dc
+import contextlib
+import io
+import time
+
+n_pix = int(sys.argv[1]) if len(sys.argv) > 1 else 3334
+density = 4
+maxfev = 1000
+
+# Models are created again on the noisy spectrum, from perturbed guesses
+with contextlib.redirect_stdout(io.StringIO()):
+    s, _ = mock(n_pix, density, 'Ly_a')
+    for z, logN, b in zip(*mock_systs(n_pix, density, 'Ly_a')):
+        s.cb._append_syst()
+        s.cb._mod_syst('Ly_a', z, logN+0.3, b*1.3)
+
+def count_eval(mod):
+    """ Wrap the model evaluation to count its calls """
+    mod._n_eval = 0
+    eval_orig = mod.eval
+    def eval(*args, **kwargs):
+        mod._n_eval += 1
+        return eval_orig(*args, **kwargs)
+    mod.eval = eval
+
+print("nfev: evaluations requested by the optimizer; neval: model evaluations, "
+      "including finite differences")
+print("%6s %6s %8s %8s %8s %8s %9s %9s %9s %9s"
+      % ('group', 'n_par', 'nfev_fd', 'nfev_jac', 'neval_fd', 'neval_jac',
+         't_fd', 't_jac', 'chi2r_fd', 'chi2r_jac'))
+tot = {'fd': [0, 0, 0], 'jac': [0, 0, 0]}
+for i, m in enumerate(s.systs._mods_t['mod']):
+    res = {}
+    for k, jac in [('fd', False), ('jac', True)]:
+        mod = dc(m)
+        count_eval(mod)
+        start = time.time()
+        mod._fit(fit_kws={'max_nfev': maxfev}, jac=jac)
+        res[k] = (mod._nfev, mod._n_eval, time.time()-start, mod._chi2r)
+        for j in range(3):
+            tot[k][j] += res[k][j]
+    n_par = len([p for p in m._pars.values() if p.vary])
+    print("%6i %6i %8i %8i %8i %8i %9.3f %9.3f %9.4f %9.4f"
+          % (i, n_par, res['fd'][0], res['jac'][0], res['fd'][1],
+             res['jac'][1], res['fd'][2], res['jac'][2], res['fd'][3],
+             res['jac'][3]))
+print("%6s %6s %8i %8i %8i %8i %9.3f %9.3f"
+      % ('total', '', tot['fd'][0], tot['jac'][0], tot['fd'][1], tot['jac'][1],
+         tot['fd'][2], tot['jac'][2]))
@@ -0,0 +1,57 @@
+""" Per-system construction cost of SystModel, step by step.
+
+A mock Lyman-alpha forest is created as in bench_suite.py, at several spectrum
+lengths; a model is then created for each line, as in Cookbook._mod_syst, and
+the wall-clock time of each step of SystModel._new_voigt (and of the update of
+the system list) is averaged over the systems. The structure of the models
+(lines, PSF and composite model) is built in _make_lines, _make_psf and
+_make_comp; _make_group and _make_regs evaluate the lines over the spectrum.
+
+Run from the repository root: python benchmarks/bench_model.py [n_pix ...]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import mock, mock_systs
+from astrocook.syst_list import SystList
+from astrocook.syst_model import SystModel
+import contextlib
+import io
+import time
+
+density = 3
+resol = 70000
+n_pix_list = [int(a) for a in sys.argv[1:]] if len(sys.argv) > 1 \
+    else [2000, 8000, 32000]
+steps = ['_make_defs', '_make_lines', '_make_group', '_make_regs',
+         '_make_psf', '_make_comp', '_update']
+
+print("Time per system (ms)")
+print("%6s %6s" % ('n_pix', 'n_syst') + ''.join([' %11s' % s for s in steps])
+      + ' %9s' % 'total')
+for n_pix in n_pix_list:
+    with contextlib.redirect_stdout(io.StringIO()):
+        s, _ = mock(n_pix, density, 'Ly_a')
+    z_lines, logN_lines, b_lines = mock_systs(n_pix, density, 'Ly_a')
+    n_lines = len(z_lines)
+    systs = SystList()
+
+    t = dict([(k, 0) for k in steps])
+    for z, logN, b in zip(z_lines, logN_lines, b_lines):
+        systs._add('Ly_a', z, logN, b, resol)
+        mod = SystModel(s.spec, systs, z0=z)
+        mod._series = 'Ly_a'
+        mod._vars = {'z': z, 'logN': logN, 'b': b, 'resol': resol}
+        for k in steps:
+            start = time.perf_counter()
+            if k == '_update':
+                systs._update(mod)
+            else:
+                getattr(mod, k)()
+            t[k] += time.perf_counter()-start
+    print("%6i %6i" % (n_pix, n_lines)
+          + ''.join([' %11.3f' % (t[k]/n_lines*1e3) for k in steps])
+          + ' %9.3f' % (sum(t.values())/n_lines*1e3))
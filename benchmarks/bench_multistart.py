@@ -0,0 +1,89 @@
+""" Wall-clock time of a multi-start fit of the models, as separate copies of
+each model fitted one at a time and as a batch of fits reusing the structure
+of the model (SystModel._fit_multi), serially and in a pool of threads.
+
+A mock Lyman-alpha forest is created as in bench_suite.py; each model is then
+fitted from several start points, with the column densities and the Doppler
+parameters of its lines randomly perturbed.
+
+Run from the repository root: python benchmarks/bench_multistart.py [n_start]
+[n_thread]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import mock, mock_systs
+from copy import deepcopy as dc
+import contextlib
+import io
+import numpy as np
+import time
+
+n_pix = 2000
+density = 3.3
+maxfev = 100
+n_start = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+n_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+# Models are created with the true parameters on the noisy spectrum
+with contextlib.redirect_stdout(io.StringIO()):
+    s, _ = mock(n_pix, density, 'Ly_a')
+    for z, logN, b in zip(*mock_systs(n_pix, density, 'Ly_a')):
+        s.cb._append_syst()
+        s.cb._mod_syst('Ly_a', z, logN, b)
+np.random.seed(0)
+
+def starts(mod):
+    """ Start points with perturbed column densities and Doppler parameters """
+    ret = []
+    for i in range(n_start):
+        start = {}
+        for n, p in mod._pars.items():
+            if p.vary and n[-5:] == '_logN':
+                start[n] = np.clip(p.value+np.random.normal(scale=0.5), p.min,
+                                   p.max)
+            if p.vary and n[-2:] == '_b':
+                start[n] = np.clip(p.value*np.random.uniform(0.5, 2), p.min,
+                                   p.max)
+        ret.append(start)
+    return ret
+
+print("%i start points per model, %i threads" % (n_start, n_thread))
+print("%6s %6s %9s %9s %9s %9s %9s %9s"
+      % ('group', 'n_par', 't_copy', 't_batch', 't_thread', 'chi2r_min',
+         'aic_min', 'bic_min'))
+tot = [0, 0, 0]
+fit_kws = {'max_nfev': maxfev}
+for i, m in enumerate(s.systs._mods_t['mod']):
+    st = starts(m)
+
+    start = time.time()
+    for p in st:
+        mod = dc(m)
+        for n, v in p.items():
+            mod._pars[n].set(value=v)
+        mod._fit(fit_kws=fit_kws)
+    t_copy = time.time()-start
+
+    start = time.time()
+    res = m._fit_multi(st, fit_kws)
+    t_batch = time.time()-start
+
+    start = time.time()
+    res_thread = m._fit_multi(st, fit_kws, n_thread=n_thread)
+    t_thread = time.time()-start
+
+    for r, r_thread in zip(res, res_thread):
+        assert np.isclose(r['chi2r'], r_thread['chi2r'])
+    tot[0] += t_copy
+    tot[1] += t_batch
+    tot[2] += t_thread
+    n_par = len([p for p in m._pars.values() if p.vary])
+    print("%6i %6i %9.3f %9.3f %9.3f %9.4f %9.2f %9.2f"
+          % (i, n_par, t_copy, t_batch, t_thread,
+             min([r['chi2r'] for r in res]), min([r['aic'] for r in res]),
+             min([r['bic'] for r in res])))
+print("%6s %6s %9.3f %9.3f %9.3f" % ('total', '', tot[0], tot[1], tot[2]))
@@ -0,0 +1,75 @@
+""" Time and memory needed to open a large session.
+
+A session with a spectrum of n_pix pixels is saved in a temporary directory,
+and opened again with Session.open, reading the files (memmap=False) or mapping
+them in memory (memmap=True). For each mode, the time to open the session and
+the increase of the resident memory are reported, both for the whole
+Session.open (including the extraction of the .acs archive) and for the
+reading of the extracted files alone. The time and memory needed to look at a
+small region of the spectrum (searching it on x and reading y within it) are
+also reported. Rows of FITS tables are stored one after the other, so reading
+a whole column of a memory-mapped file reads the whole table.
+
+Run from the repository root: python benchmarks/bench_open.py [n_pix]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import flat_spectrum, measure
+from astrocook import Session
+from astrocook.format import Format
+from astropy.io import fits
+import bisect
+import contextlib
+import io
+import numpy as np
+import tarfile
+import tempfile
+
+n_pix = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+
+def look(sess, xmin=350.0, xmax=351.0):
+    # bisect reads only the rows it compares, while np.searchsorted would
+    # convert the whole column from the byte order of the file
+    x = sess.spec.x.value
+    i0, i1 = bisect.bisect_left(x, xmin), bisect.bisect_right(x, xmax)
+    return np.mean(sess.spec.y.value[i0:i1])
+
+def open_sess(path, memmap):
+    sess = Session(path=path, name='bench')
+    sess.open(memmap=memmap)
+    return sess
+
+def open_files(path, memmap):
+    kw = {'memmap': True, 'mode': 'copyonwrite'} if memmap else {}
+    sess = Session(path=path, name='bench')
+    sess.spec = Format(copy=not memmap).astrocook(
+        fits.open(path[:-4]+'_spec.fits', **kw), 'spec')
+    return sess
+
+with tempfile.TemporaryDirectory() as root:
+    path = os.path.join(root, 'bench.acs')
+    sess = Session(name='bench', spec=flat_spectrum(n_pix, cont=True))
+    with contextlib.redirect_stdout(io.StringIO()):
+        sess.save(path)
+    del sess
+
+    # Files read by open_files (Session.open with memmap=True extracts the
+    # archive in a temporary directory of its own)
+    with tarfile.open(path) as arch:
+        arch.extractall(path=root)
+
+    print("Spectrum of %i pixels" % n_pix)
+    print("%-8s %-18s %9s %8s" % ('memmap', 'step', 'time_ms', 'rss_MB'))
+    for memmap in [True, False]:
+        for name, func in [('Session.open', open_sess),
+                           ('read files', open_files)]:
+            sess, wall, mem = measure(lambda: func(path, memmap))
+            print("%-8s %-18s %9.1f %8.1f" % (memmap, name, wall*1e3, mem))
+            _, wall, mem = measure(lambda: look(sess))
+            print("%-8s %-18s %9.1f %8.1f" % (memmap, '  look at region',
+                                              wall*1e3, mem))
+            del sess
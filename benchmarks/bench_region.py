@@ -0,0 +1,71 @@
+""" Time and memory needed to work on a region of a large spectrum.
+
+An ESPRESSO S1D table (wavelength, flux and error columns) and a UVES POPLER
+image (log-linear wavelength grid from CRVAL1 and CDELT1) of n_pix pixels are
+written in a temporary directory. A 1-nm region of each is then obtained in
+two ways: opening the whole spectrum with Session.open and extracting the
+region with Session.extract_region, or opening only the region with
+Session.open(xmin=..., xmax=...). The time and the increase of the resident
+memory are reported for each.
+
+Run from the repository root (the ESPRESSO format needs espr_spec_form.dat):
+python benchmarks/bench_region.py [n_pix]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import measure
+from astrocook import Session
+from astropy import table as at
+from astropy.io import fits
+import numpy as np
+import tempfile
+
+n_pix = int(sys.argv[1]) if len(sys.argv) > 1 else 5000000
+xmin, xmax = 350.0, 351.0
+
+def open_extract(path):
+    sess = Session(path=path, name='bench')
+    sess.open()
+    return sess.extract_region(xmin, xmax)
+
+def open_region(path):
+    sess = Session(path=path, name='bench')
+    sess.open(xmin=xmin, xmax=xmax)
+    return sess
+
+with tempfile.TemporaryDirectory() as root:
+    rng = np.random.RandomState(0)
+    crval1, cdelt1 = np.log10(3000.0), 1e-6
+    x = 10**(crval1+np.arange(n_pix)*cdelt1)
+
+    drs = os.path.join(root, 'drs.fits')
+    hdu = fits.PrimaryHDU()
+    hdu.header['INSTRUME'] = 'ESPRESSO'
+    hdu.header['HIERARCH ESO PRO CATG'] = 'S1D_A'
+    t = at.Table({'wavelength': x, 'flux': rng.rand(n_pix),
+                  'error': rng.rand(n_pix)})
+    fits.HDUList([hdu, fits.BinTableHDU(t)]).writeto(drs)
+    del t
+
+    popler = os.path.join(root, 'popler.fits')
+    hdu = fits.PrimaryHDU(rng.rand(4, n_pix))
+    hdu.header['CRVAL1'] = crval1
+    hdu.header['CDELT1'] = cdelt1
+    hdu.header['HISTORY'] = 'UVES_popler: bench'
+    hdu.writeto(popler)
+    del hdu, x
+
+    print("Spectrum of %i pixels, region %.1f-%.1f nm" % (n_pix, xmin, xmax))
+    print("%-14s %-22s %9s %8s %8s"
+          % ('format', 'step', 'time_ms', 'rss_MB', 'n_pix'))
+    for name, path in [('ESPRESSO S1D', drs), ('UVES POPLER', popler)]:
+        for step, func in [('open + extract_region', open_extract),
+                           ('open region', open_region)]:
+            sess, wall, mem = measure(lambda: func(path))
+            print("%-14s %-22s %9.1f %8.1f %8i"
+                  % (name, step, wall*1e3, mem, len(sess.spec.t)))
+            del sess
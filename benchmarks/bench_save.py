@@ -0,0 +1,46 @@
+""" Time needed to save and open again a large session.
+
+A session with a spectrum of n_pix pixels (and a line list) is saved in a
+temporary directory with Session.save, at different levels of gzip
+compression of the archive (0 for an uncompressed archive) and with one or
+more threads. The time to save the session, the size of the archive and the
+time to open it again with Session.open are reported.
+
+Run from the repository root: python benchmarks/bench_save.py [n_pix]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import flat_spectrum, measure
+from astrocook import Session
+from astrocook.line_list import LineList
+import tempfile
+
+n_pix = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+
+def open_sess(path):
+    sess = Session(path=path, name='bench')
+    sess.open()
+    return sess
+
+with tempfile.TemporaryDirectory() as root:
+    spec = flat_spectrum(n_pix, cont=True)
+    sel = slice(0, n_pix, 1000)
+    lines = LineList(*[spec._t[c][sel] for c in ['x', 'xmin', 'xmax', 'y',
+                                                 'dy']])
+    sess = Session(name='bench', spec=spec, lines=lines)
+
+    print("Spectrum of %i pixels, %i cores" % (n_pix, os.cpu_count()))
+    print("%-9s %-9s %9s %9s %9s"
+          % ('compress', 'n_thread', 'save_ms', 'size_MB', 'open_ms'))
+    for compress in [9, 6, 1, 0]:
+        for n_thread in [1, 0]:
+            path = os.path.join(root, 'bench_%i_%i.acs' % (compress, n_thread))
+            _, save, _ = measure(lambda: sess.save(path, compress, n_thread))
+            size = os.path.getsize(path)/2**20
+            _, open, _ = measure(lambda: open_sess(path))
+            print("%-9i %-9i %9.1f %9.1f %9.1f"
+                  % (compress, n_thread, save*1e3, size, open*1e3))
@@ -0,0 +1,276 @@
+""" Benchmark suite for the absorption-fitting pipeline.
+
+Synthetic spectra are created as in mock_demo.py, with a Lyman-alpha forest
+(for line fitting) and a population of CIV doublets (for sliding and
+completeness), at several spectrum lengths and line densities. For each
+configuration the following stages are run and timed:
+    -# lines_voigt: evaluation of a Voigt model over the whole spectrum;
+    -# convolve: convolution of the model with the PSF of its regions;
+    -# new_voigt: creation of a SystModel for each line;
+    -# add_syst_from_lines, add_syst_from_resids: fit of the Lyman-alpha
+       forest;
+    -# add_syst_slide, compl_syst: detection and completeness of CIV doublets.
+For each stage, the wall time, the total number of function evaluations of
+the fits, the number of fits and the peak memory allocated (traced with
+tracemalloc) are written to a JSON file, to track regressions across
+releases. Errors of the stages are recorded too, and make the suite exit with
+a non-zero status.
+
+Run from the repository root: python benchmarks/bench_suite.py [-h]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from astrocook import version
+from astrocook.functions import convolve, lines_voigt, psf_gauss
+from astrocook.line_list import LineList
+from astrocook.session import Session
+from astrocook.spectrum import Spectrum
+from astrocook.syst_model import SystModel
+from astrocook.vars import *
+from copy import deepcopy as dc
+import argparse
+import contextlib
+import datetime
+import gc
+import io
+import json
+import numpy as np
+import platform
+import time
+import tracemalloc
+
+xstart = 300
+xstep = 0.003
+texp = 2
+resol = 70000
+
+counter = {'nfev': 0, 'n_fit': 0}
+_fit_orig = SystModel._fit
+
+def _fit_count(self, *args, **kwargs):
+    """ Wrap SystModel._fit to count fits and function evaluations (only
+    while a stage is run, see stage) """
+    _fit_orig(self, *args, **kwargs)
+    counter['nfev'] += self._nfev
+    counter['n_fit'] += 1
+
+def mock_systs(n_pix, density, series='Ly_a', seed=0, rng=None):
+    """ Redshifts, column densities and Doppler parameters of the absorption
+    systems of a mock spectrum (the ones used by mock, with the same n_pix,
+    density, series and seed). The random generator can be given as rng """
+
+    if rng is None:
+        rng = np.random.RandomState(seed)
+    xrange = xstart + np.arange(n_pix)*xstep
+    n_lines = max(1, int(round(density*(xrange[-1]-xrange[0]))))
+    xem = atom_t['xem'][series_i_d[series][0]]
+    x_lines = rng.random_sample(n_lines)*(xrange[-1]-xrange[0])+xrange[0]
+    z_lines = np.sort(x_lines/xem-1)
+    logN_lines = -rng.power(3, n_lines)*3+15
+    b_lines = rng.poisson(10, n_lines)+rng.random_sample()-0.5
+    return z_lines, logN_lines, b_lines
+
+def mock(n_pix, density, series='Ly_a', seed=0):
+    """ Mock spectrum with absorption systems of a given series, with a
+    density given in systems per nm """
+
+    rng = np.random.RandomState(seed)
+    xrange = xstart + np.arange(n_pix)*xstep
+    z_lines, logN_lines, b_lines = mock_systs(n_pix, density, series,
+                                              rng=rng)
+
+    s = Session(name='mock')
+    s.spec = Spectrum(x=xrange,
+                      xmin=xrange-xstep*0.5,
+                      xmax=xrange+xstep*0.5,
+                      y=np.ones(xrange.shape),
+                      dy=np.ones(xrange.shape)/(50*np.sqrt(texp)))
+    s.spec.t['cont'] = np.ones(xrange.shape)*s.spec.y.unit
+    x_lines = (1+z_lines)*atom_t['xem'][series_i_d[series][0]]
+    s.lines = LineList(x=x_lines,
+                       xmin=x_lines-xstep*5,
+                       xmax=x_lines+xstep*5,
+                       y=np.zeros(x_lines.shape),
+                       dy=np.zeros(x_lines.shape))
+    for z, logN, b in zip(z_lines, logN_lines, b_lines):
+        s.cb._append_syst()
+        s.cb._mod_syst(series, z, logN, b, resol)
+    s.cb._update_spec()
+    s.spec.y = s.spec.t['model']+rng.normal(scale=s.spec.dy)
+    s.spec._t['lines_mask'] = np.zeros(len(xrange), dtype=bool)
+    s.systs = None
+    return s, z_lines
+
+def flat_spectrum(n_pix, cont=False, seed=0):
+    """ Spectrum with a logarithmic wavelength grid from 300 nm and a flat
+    normalized flux with 5% gaussian noise, optionally with a continuum """
+
+    x = 300*np.exp(np.arange(n_pix)*1e-6)
+    xmin = np.append(x[0], 0.5*(x[1:]+x[:-1]))
+    xmax = np.append(0.5*(x[1:]+x[:-1]), x[-1])
+    rng = np.random.RandomState(seed)
+    y = 1+0.05*rng.standard_normal(n_pix)
+    dy = np.full(n_pix, 0.05)
+    return Spectrum(x, xmin, xmax, y, dy, cont=np.ones(n_pix) if cont else [])
+
+def rss():
+    """ Resident memory of the process (MB) """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/2**20
+
+def measure(func):
+    """ Run a function silently, measuring wall time and the increase of the
+    resident memory """
+
+    gc.collect()
+    rss_start = rss()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        out = func()
+    return out, time.perf_counter()-start, rss()-rss_start
+
+def stage(name, func, *args, **kwargs):
+    """ Run a stage, measuring wall time, function evaluations of the fits and
+    peak memory """
+
+    counter['nfev'] = 0
+    counter['n_fit'] = 0
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    error = None
+    SystModel._fit = _fit_count
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            func(*args, **kwargs)
+    except Exception as e:
+        error = "%s: %s" % (type(e).__name__, e)
+    finally:
+        SystModel._fit = _fit_orig
+    wall = time.perf_counter()-start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    ret = {'stage': name, 'wall_s': wall, 'nfev': counter['nfev'],
+           'n_fit': counter['n_fit'], 'peak_mem_mb': peak/2**20,
+           'error': error}
+    print("  %-22s %9.3f s %8i nfev %6i fits %9.1f MB%s"
+          % (name, wall, counter['nfev'], counter['n_fit'], peak/2**20,
+             '' if error is None else '  ('+error+')'))
+    return ret
+
+def skipped(name):
+    print("  %-22s skipped" % name)
+    return {'stage': name, 'skipped': True}
+
+def run_lines_voigt(x, z_lines):
+    for z in z_lines:
+        lines_voigt(x, z, 14, 10, 0, 'Ly_a')
+
+def run_convolve(sess, n_rep=10):
+    for m in sess.systs._mods_t['mod']:
+        x = m._xs
+        y = m._group.eval(x=x, params=m._pars)
+        psf = [p for r in m._xr for p in psf_gauss(x, resol, r)]
+        for i in range(n_rep):
+            convolve(y, psf)
+
+def run_new_voigt(sess, z_lines):
+    for z in z_lines:
+        sess.cb._append_syst()
+        sess.cb._mod_syst('Ly_a', z, 13, 10, resol)
+
+def run_config(n_pix, density, maxfev, slide_max_pix, seed, n_proc=1):
+    print("Spectrum of %i pixels, %2.1f systems per nm:" % (n_pix, density))
+    with contextlib.redirect_stdout(io.StringIO()):
+        forest, z_forest = mock(n_pix, density, 'Ly_a', seed)
+        doubl, z_doubl = mock(n_pix, density, 'CIV', seed)
+    x = np.array(forest.spec.x.to(au.nm))
+    stages = []
+
+    stages.append(stage('lines_voigt', run_lines_voigt, x, z_forest))
+    new = Session(spec=forest.spec, lines=forest.lines)
+    stages.append(stage('new_voigt', run_new_voigt, new, z_forest))
+    stages.append(stage('convolve', run_convolve, new))
+    stages.append(stage('add_syst_from_lines', forest.add_syst_from_lines,
+                        series='Ly_a', logN=13, b=10, resol=resol,
+                        maxfev=maxfev, n_proc=n_proc))
+    stages.append(stage('add_syst_from_resids', forest.add_syst_from_resids,
+                        resol=resol, logN=12, b=5, chi2r_thres=2.0,
+                        maxfev=maxfev))
+    if n_pix <= slide_max_pix:
+        compl = dc(doubl)
+        stages.append(stage('add_syst_slide', doubl.add_syst_slide,
+                            series='CIV', logN_start=14, logN_end=13.5,
+                            logN_step=-1, b_start=10, b_end=11, b_step=2,
+                            resol=resol, maxfev=maxfev))
+        z_mid = np.median(x)/atom_t['xem'][trans_i_d['CIV_1548']]-1
+        stages.append(stage('compl_syst', compl.compl_syst, series='CIV',
+                            n=5, z_start=z_mid-1e-3, z_end=z_mid+1e-3,
+                            z_step=1e-3, logN_start=14, logN_end=13.5,
+                            logN_step=-1, b_start=10, b_end=11, b_step=2,
+                            resol=resol, maxfev=maxfev))
+    else:
+        stages.append(skipped('add_syst_slide'))
+        stages.append(skipped('compl_syst'))
+
+    done = [s for s in stages if 'wall_s' in s]
+    total = {'wall_s': sum([s['wall_s'] for s in done]),
+             'nfev': sum([s['nfev'] for s in done]),
+             'peak_mem_mb': max([s['peak_mem_mb'] for s in done])}
+    return {'n_pix': n_pix, 'density': density, 'n_forest': len(z_forest),
+            'n_doubl': len(z_doubl), 'stages': stages, 'total': total}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite for the "
+                                     "absorption-fitting pipeline.")
+    parser.add_argument('-n', '--n_pix', type=int, nargs='+',
+                        default=[2000, 8000, 32000],
+                        help="Spectrum lengths (pixels)")
+    parser.add_argument('-d', '--density', type=float, nargs='+',
+                        default=[1.0, 3.0],
+                        help="Densities of systems (per nm)")
+    parser.add_argument('-m', '--maxfev', type=int, default=100,
+                        help="Maximum number of function evaluations per fit")
+    parser.add_argument('-s', '--slide_max_pix', type=int, default=8000,
+                        help="Maximum spectrum length for add_syst_slide and "
+                        "compl_syst")
+    parser.add_argument('-o', '--output', default='bench_suite.json',
+                        help="Output JSON file")
+    parser.add_argument('-p', '--n_proc', type=int, default=1,
+                        help="Number of processes for add_syst_from_lines (0 "
+                        "to use all the cores)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    runs = []
+    for n_pix in args.n_pix:
+        for density in args.density:
+            runs.append(run_config(n_pix, density, args.maxfev,
+                                   args.slide_max_pix, args.seed,
+                                   args.n_proc))
+
+    out = {'astrocook_version': version,
+           'date': datetime.datetime.now().isoformat(),
+           'python': platform.python_version(),
+           'numpy': np.__version__,
+           'platform': platform.platform(),
+           'args': vars(args),
+           'runs': runs}
+    with open(args.output, 'w') as f:
+        json.dump(out, f, indent=1)
+    print("Results saved in %s." % args.output)
+
+    # Errors are recorded in the results, but a run with failing stages is
+    # not a valid baseline
+    failed = ["%i pixels, %2.1f per nm: %s" % (r['n_pix'], r['density'],
+                                               s['stage'])
+              for r in runs for s in r['stages'] if s.get('error')]
+    if failed:
+        print("Failed stages:\n  "+"\n  ".join(failed))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
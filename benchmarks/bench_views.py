@@ -0,0 +1,81 @@
+""" Copies of the spectrum columns made on the recipe paths.
+
+A mock spectrum (Lyman-alpha forest and CIV doublets) is created as in
+bench_suite.py; some recipes are then run, counting the columns that are
+copied into a new Quantity (e.g. by the Frame.x, .y, .dy, .xmin and .xmax
+accessors) and the arrays that are copied by Quantity.to (e.g. by
+spec.x.to(au.nm)), with the total size of the copies and the wall-clock time.
+
+Run from the repository root: python benchmarks/bench_views.py [n_pix]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import mock
+from astropy import table as at
+from astropy import units as au
+import contextlib
+import io
+import numpy as np
+import time
+
+n_pix = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+resol = 70000
+counter = {'col': 0, 'to': 0, 'bytes': 0}
+
+_new_orig = au.Quantity.__new__
+_to_orig = au.Quantity.to
+
+def _new_count(cls, value, *args, **kwargs):
+    """ Wrap Quantity.__new__ to count the copies of columns """
+    q = _new_orig(cls, value, *args, **kwargs)
+    if isinstance(value, at.Column) and not np.may_share_memory(q, value):
+        counter['col'] += 1
+        counter['bytes'] += q.nbytes
+    return q
+
+def _to_count(self, *args, **kwargs):
+    """ Wrap Quantity.to to count the copies of arrays """
+    q = _to_orig(self, *args, **kwargs)
+    if np.ndim(q) > 0:
+        counter['to'] += 1
+        counter['bytes'] += q.nbytes
+    return q
+
+au.Quantity.__new__ = staticmethod(_new_count)
+au.Quantity.to = _to_count
+
+def run(name, func, *args, **kwargs):
+    for k in counter:
+        counter[k] = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args, **kwargs)
+    wall = time.perf_counter()-start
+    print("%-22s %8i %8i %10.1f %9.3f"
+          % (name, counter['col'], counter['to'], counter['bytes']/2**20,
+             wall))
+
+def update_spec(sess, n=10):
+    for i in range(n):
+        sess.cb._update_spec()
+
+with contextlib.redirect_stdout(io.StringIO()):
+    forest, _ = mock(n_pix, 3, 'Ly_a')
+    doubl, _ = mock(n_pix, 1, 'CIV')
+print("Spectrum of %i pixels" % n_pix)
+print("%-22s %8s %8s %10s %9s"
+      % ('recipe', 'col_copy', 'to_copy', 'copied_MB', 'wall_s'))
+run('convolve_gauss', forest.convolve_gauss, std=5)
+run('find_peaks', forest.find_peaks, kappa=5)
+run('extract_nodes', forest.extract_nodes, delta_x=500)
+run('interp_nodes', forest.interp_nodes)
+run('add_syst_from_lines', forest.add_syst_from_lines, series='Ly_a',
+    logN=13, b=10, resol=resol, maxfev=10)
+run('_update_spec (x10)', update_spec, forest)
+run('add_syst_slide', doubl.add_syst_slide, series='CIV', logN_start=14,
+    logN_end=13.5, logN_step=-1, b_start=10, b_end=11, b_step=2, resol=resol,
+    maxfev=0)
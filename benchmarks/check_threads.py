@@ -0,0 +1,71 @@
+""" Concurrency check of the creation and fit of the models.
+
+A mock Lyman-alpha forest is created as in bench_suite.py; a model is then
+created and fitted for each line, from perturbed guesses, first serially and
+then from a pool of threads. Each line is modelled in its own system list, so
+that the threads share only the spectrum and the defaults of the parameters.
+The results of the threads must be identical to the serial ones, and the
+standard defaults must be left untouched: otherwise, the script exits with
+status 1 (it is meant to be run as a check, e.g. before a release).
+
+Run from the repository root: python benchmarks/check_threads.py [n_thread]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import mock, mock_systs
+from astrocook.syst_list import SystList
+from astrocook.syst_model import SystModel
+from astrocook.vars import *
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy as dc
+import contextlib
+import io
+import numpy as np
+
+n_pix = 3334
+density = 6
+resol = 70000
+maxfev = 100
+n_thread = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+
+with contextlib.redirect_stdout(io.StringIO()):
+    s, _ = mock(n_pix, density, 'Ly_a')
+z_lines, logN_lines, b_lines = mock_systs(n_pix, density, 'Ly_a')
+n_lines = len(z_lines)
+spec = s.spec
+
+def fit(args):
+    """ Create and fit the model of a line in its own system list """
+    z, logN, b = args
+    systs = SystList()
+    systs._add('Ly_a', z, logN, b, resol)
+    mod = SystModel(spec, systs, z0=z)
+    mod._new_voigt('Ly_a', z, logN, b, resol)
+    systs._update(mod)
+    mod._fit(fit_kws={'max_nfev': maxfev})
+    systs._update(mod, mod_t=False)
+    return np.array([p.value for p in mod._pars.values()]), mod._chi2r
+
+guess = list(zip(z_lines, logN_lines+0.3, b_lines*1.3))
+defs = dc(pars_std_d)
+ser = [fit(g) for g in guess]
+
+# Threads are switched as often as possible, to expose race conditions
+sys.setswitchinterval(1e-6)
+with ThreadPoolExecutor(n_thread) as ex:
+    thr = list(ex.map(fit, guess))
+
+diff = [i for i, (r, t) in enumerate(zip(ser, thr))
+        if len(r[0]) != len(t[0])
+        or not np.array_equal(r[0], t[0], equal_nan=True)
+        or not np.array_equal(r[1], t[1], equal_nan=True)]
+print("%i systems fitted serially and from %i threads: %i differ."
+      % (n_lines, n_thread, len(diff)))
+print("Standard defaults %s." % ("untouched" if pars_std_d == defs
+                                 else "modified"))
+if len(diff) > 0 or pars_std_d != defs:
+    sys.exit(1)